@@ -0,0 +1,139 @@
+# needs NumPy (see requirements.txt). nothing in the exchange imports this module, so the
+# server itself still runs on the standard library alone
+import numpy as np
+
+from book import *
+
+class SideView:
+    # one side of a book as contiguous arrays, best level first: the price of each level in
+    # ticks, the amount resting there, and running totals of amount and of price * amount.
+    # building one costs a pass over the levels, not the orders; every query after that is
+    # a vectorized lookup. a view is a snapshot, so it is built by the thread that owns the
+    # book (or while nothing else is changing it) and is safe to share once built
+    __slots__ = ("descending", "prices", "amounts", "cumulative", "notional")
+
+    def __init__(self, levels):
+        self.descending = levels.direction == 1
+        prices = [key * levels.direction for key in reversed(levels.keys)]
+        self.prices = np.array(prices, dtype=np.int64)
+        self.amounts = np.array([levels.volumes[price] for price in prices], dtype=np.int64)
+        self.cumulative = np.cumsum(self.amounts)
+        self.notional = np.cumsum(self.prices * self.amounts)
+
+    def total(self):
+        return int(self.cumulative[-1]) if len(self.cumulative) > 0 else 0
+
+    def cumulative_depth(self, levels=None):
+        # running amount available through each of the best levels
+        return self.cumulative if levels == None else self.cumulative[:levels]
+
+    def fill_costs(self, sizes):
+        # for each size: how much of it the side can fill, what that costs in ticks * amount,
+        # and the worst price it reaches (0 where nothing fills)
+        sizes = np.asarray(sizes, dtype=np.int64)
+        if len(self.cumulative) == 0:
+            zeros = np.zeros(sizes.shape, dtype=np.int64)
+            return zeros, zeros, zeros
+
+        filled = np.minimum(sizes, self.cumulative[-1])
+        # the level each fill ends in, and what the levels before it add up to
+        last = np.minimum(np.searchsorted(self.cumulative, filled), len(self.cumulative) - 1)
+        before_amount = np.where(last > 0, self.cumulative[last - 1], 0)
+        before_notional = np.where(last > 0, self.notional[last - 1], 0)
+        costs = before_notional + (filled - before_amount) * self.prices[last]
+        worst = np.where(filled > 0, self.prices[last], 0)
+        return filled, costs, worst
+
+    def vwaps(self, sizes):
+        # average fill price in ticks for each size, nan where nothing fills
+        filled, costs, _ = self.fill_costs(sizes)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(filled > 0, costs / filled, np.nan)
+
+    def impact_curve(self, sizes):
+        # how far the average fill price for each size moves away from the best price, in ticks
+        if len(self.prices) == 0:
+            return np.full(np.shape(sizes), np.nan)
+        return np.abs(self.vwaps(sizes) - self.prices[0])
+
+    def available_through(self, price):
+        # the amount resting at price or better
+        # prices run best first, so descending for bids and ascending for asks
+        if self.descending:
+            count = np.searchsorted(-self.prices, -price, side="right")
+        else:
+            count = np.searchsorted(self.prices, price, side="right")
+        return int(self.cumulative[count - 1]) if count > 0 else 0
+
+class BookView:
+    # bids and asks of one book, captured together
+    __slots__ = ("symbol", "bids", "asks")
+
+    def __init__(self, book):
+        self.symbol = book.symbol
+        self.bids = SideView(book.bids)
+        self.asks = SideView(book.asks)
+
+    def side(self, side):
+        # the side an order on side would trade against
+        return self.asks if side == BUY else self.bids
+
+    def spread(self):
+        if len(self.bids.prices) == 0 or len(self.asks.prices) == 0:
+            return None
+        return int(self.asks.prices[0] - self.bids.prices[0])
+
+    def mid(self):
+        if len(self.bids.prices) == 0 or len(self.asks.prices) == 0:
+            return None
+        return (int(self.asks.prices[0]) + int(self.bids.prices[0])) / 2
+
+    def imbalance(self, levels=None):
+        # (bid amount - ask amount) / total over the best levels, from -1 all asks to 1 all bids
+        bid_depth = self.bids.cumulative_depth(levels)
+        ask_depth = self.asks.cumulative_depth(levels)
+        bid_amount = int(bid_depth[-1]) if len(bid_depth) > 0 else 0
+        ask_amount = int(ask_depth[-1]) if len(ask_depth) > 0 else 0
+        if bid_amount + ask_amount == 0:
+            return 0.0
+        return (bid_amount - ask_amount) / (bid_amount + ask_amount)
+
+if __name__ == "__main__":
+    import random
+    rng = random.Random(0)
+    book = Book(PARKER)
+    for i in range(2000):
+        if i % 2 == 0:
+            book.add(Order(PARKER, BUY, rng.randint(100, 499), rng.randint(1, 50)), (0, i))
+        else:
+            book.add(Order(PARKER, SELL, rng.randint(501, 900), rng.randint(1, 50)), (0, i))
+
+    view = BookView(book)
+    bid_depth, ask_depth = book.depth()
+    assert view.bids.prices.tolist() == [price for price, _ in bid_depth]
+    assert view.asks.amounts.tolist() == [amount for _, amount in ask_depth]
+    assert view.spread() == ask_depth[0][0] - bid_depth[0][0]
+
+    # every vectorized cost matches walking the levels one at a time
+    sizes = [0, 1, 7, 50, 1000, view.asks.total(), view.asks.total() + 10]
+    filled, costs, worst = view.asks.fill_costs(sizes)
+    for i in range(len(sizes)):
+        remaining = sizes[i]
+        cost = 0
+        last_price = 0
+        for price, amount in ask_depth:
+            if remaining == 0:
+                break
+            taken = min(remaining, amount)
+            cost += taken * price
+            remaining -= taken
+            last_price = price
+        assert filled[i] == sizes[i] - remaining
+        assert costs[i] == cost
+        assert worst[i] == last_price
+
+    limit = bid_depth[10][0]
+    assert view.bids.available_through(limit) == sum([amount for price, amount in bid_depth if price >= limit])
+    assert view.asks.available_through(ask_depth[0][0] - 1) == 0
+    assert -1 <= view.imbalance(5) <= 1
+    assert BookView(Book(PARKER)).asks.fill_costs([5])[0][0] == 0
@@ -0,0 +1,119 @@
+import os
+import time
+import datetime
+import threading
+import collections
+
+# how the log is made durable: NONE leaves it to the OS after each flush, INTERVAL
+# fsyncs at most every fsync_interval seconds, RECORD blocks each write until it is fsynced
+NONE = "NONE"
+INTERVAL = "INTERVAL"
+RECORD = "RECORD"
+DURABILITY_MODES = set([NONE, INTERVAL, RECORD])
+
+LOG_BUFFER_SIZE = 65536
+FLUSH_SIZE = 1024
+FLUSH_INTERVAL = 0.05
+
+def format_record(timestamp, string, unique_id, args):
+    date = datetime.datetime.fromtimestamp(timestamp)
+    log_string = f"{str(date)}: "
+    if unique_id != None:
+        client_id, msg_id = unique_id
+        log_string += f"CLIENT {str(client_id)}, MESSAGE {str(msg_id)}: "
+    if len(args) > 0:
+        string = string.format(*args)
+    log_string += f"{string}\n"
+    return log_string
+
+class AuditLog(threading.Thread):
+    # callers only append a raw record to a bounded ring buffer; timestamps are taken
+    # there but formatting, writing and syncing all happen on this thread in batches,
+    # each timed into histogram when one is given
+    def __init__(self, log_file, durability=NONE, fsync_interval=1.0,
+                 capacity=LOG_BUFFER_SIZE, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL, histogram=None):
+        super(AuditLog, self).__init__(daemon=True)
+        assert durability in DURABILITY_MODES
+
+        self.log_file = log_file
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.histogram = histogram
+
+        self.records = collections.deque()
+        self.condition = threading.Condition()
+        self.appended = 0
+        self.written = 0
+        self.last_sync = time.monotonic()
+        self.dirty = False
+        self.stopped = False
+
+    def write(self, string, unique_id=None, args=()):
+        self.condition.acquire()
+        while len(self.records) >= self.capacity:
+            self.condition.wait()
+        self.records.append((time.time(), string, unique_id, args))
+        self.appended += 1
+        sequence = self.appended
+        if len(self.records) >= self.flush_size or self.durability == RECORD:
+            self.condition.notify_all()
+        if self.durability == RECORD:
+            while self.written < sequence:
+                self.condition.wait()
+        self.condition.release()
+
+    def stop(self):
+        self.condition.acquire()
+        self.stopped = True
+        self.condition.notify_all()
+        self.condition.release()
+        self.join()
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            if len(self.records) < self.flush_size and not self.stopped and self.durability != RECORD:
+                self.condition.wait(self.flush_interval)
+            while len(self.records) == 0 and not self.stopped and not self.sync_due():
+                self.condition.wait(self.flush_interval)
+            records = self.records
+            self.records = collections.deque()
+            sequence = self.appended
+            stopped = self.stopped
+            # producers blocked on a full buffer can continue while we write
+            self.condition.notify_all()
+            self.condition.release()
+
+            start = time.perf_counter_ns()
+            if len(records) > 0:
+                self.log_file.write("".join([format_record(*record) for record in records]))
+                self.log_file.flush()
+                self.dirty = True
+            if self.durability == RECORD or stopped or self.sync_due():
+                self.sync()
+            if self.histogram != None and len(records) > 0:
+                self.histogram.record(time.perf_counter_ns() - start)
+
+            self.condition.acquire()
+            self.written = sequence
+            self.condition.notify_all()
+            self.condition.release()
+
+            if stopped:
+                return
+
+    def sync_due(self):
+        return self.durability == INTERVAL and self.dirty and time.monotonic() - self.last_sync >= self.fsync_interval
+
+    def sync(self):
+        if self.durability != NONE and self.dirty:
+            try:
+                os.fsync(self.log_file.fileno())
+            except (AttributeError, OSError, ValueError):
+                # in-memory logs have nothing to sync
+                pass
+        self.last_sync = time.monotonic()
+        self.dirty = False
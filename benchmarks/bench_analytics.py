@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import *
+from symbol import *
+from analytics import *
+
+LEVELS = 1000
+SIZES = 1000
+
+def build_book(levels, rng):
+    book = Book(PARKER)
+    for i in range(levels):
+        book.add(Order(PARKER, SELL, 1000 + i, rng.randint(1, 100)), (0, i))
+    return book
+
+def walk_cost(depth, size):
+    # what answering one query costs without the arrays: a Python pass over the levels
+    remaining = size
+    cost = 0
+    for price, amount in depth:
+        if remaining == 0:
+            break
+        taken = min(remaining, amount)
+        cost += taken * price
+        remaining -= taken
+    return cost
+
+def measure(levels, sizes):
+    rng = random.Random(1)
+    book = build_book(levels, rng)
+    total = sum([amount for _, amount in book.asks.depth()])
+    queries = [rng.randint(1, total) for _ in range(sizes)]
+
+    start = time.perf_counter()
+    depth = book.asks.depth()
+    for size in queries:
+        walk_cost(depth, size)
+    walk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    view = BookView(book)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    view.asks.fill_costs(queries)
+    query_seconds = time.perf_counter() - start
+    return walk_seconds / sizes, build_seconds, query_seconds / sizes
+
+if __name__ == "__main__":
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else LEVELS
+    walk, build, query = measure(levels, SIZES)
+    print(f"{'python walk':<24}{walk * 1e6:8.2f} us/query")
+    print(f"{'view build':<24}{build * 1e6:8.2f} us")
+    print(f"{'vectorized':<24}{query * 1e6:8.2f} us/query")
@@ -0,0 +1,26 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message import *
+
+ITERATIONS = 100000
+
+def bench(label, func, iterations):
+    seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+    print(f"{label:<24}{seconds / iterations * 1e9:8.0f} ns/msg")
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+
+    msg = Message(ADD, Order(PARKER, BUY, PARKER.to_ticks("4.95"), 25))
+    text = msg.serialize()
+    record = msg.pack()
+
+    print(f"ADD message: text {str(len(text))} bytes, binary {str(len(record))} bytes")
+    bench("text serialize", msg.serialize, iterations)
+    bench("text deserialize", lambda: Message.deserialize(text), iterations)
+    bench("binary pack", msg.pack, iterations)
+    bench("binary unpack", lambda: Message.unpack(record), iterations)
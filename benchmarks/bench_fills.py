@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import *
+from symbol import *
+
+LEVELS = 10000
+
+def build_book(levels):
+    book = Book(PARKER)
+    for i in range(levels):
+        book.add(Order(PARKER, SELL, 1000 + i, 1), i)
+    return book
+
+def sweep(book, levels):
+    return book.add(Order(PARKER, BUY, 1000 + levels, levels), levels)
+
+def measure_allocations(levels):
+    book = build_book(levels)
+    # keep the resting orders and levels alive so the snapshot diff only counts
+    # what the sweep itself allocates and hands back to the caller
+    alive = list(book.open_orders.values()) + list(book.asks.levels.values())
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fills = sweep(book, levels)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return blocks / levels, size / levels
+
+def measure_time(levels):
+    book = build_book(levels)
+    start = time.perf_counter()
+    sweep(book, levels)
+    return (time.perf_counter() - start) / levels
+
+if __name__ == "__main__":
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else LEVELS
+    blocks, size = measure_allocations(levels)
+    seconds = measure_time(levels)
+    print(f"fills per sweep:      {str(levels)}")
+    print(f"allocations per fill: {blocks:.2f} blocks, {size:.1f} bytes")
+    print(f"time per fill:        {seconds * 1e6:.2f} us")
@@ -0,0 +1,42 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import *
+from symbol import *
+
+ORDERS = 1000000
+LEVELS = 1000
+
+def build_book(orders, levels):
+    book = Book(PARKER)
+    for i in range(orders):
+        # bids below and asks above the mid so nothing crosses and every order rests
+        offset = i % levels
+        if i % 2 == 0:
+            order = Order(PARKER, BUY, 100000 - offset, 10)
+        else:
+            order = Order(PARKER, SELL, 100001 + offset, 10)
+        book.add(order, (i % 1000, i))
+    return book
+
+if __name__ == "__main__":
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else ORDERS
+    gc.collect()
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    book = build_book(orders, LEVELS)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    end_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(book.open_orders) == orders
+
+    print(f"resting orders:          {str(orders)}")
+    print(f"bytes per resting order: {(end_size - start_size) / orders:.1f}")
+    print(f"build time:              {seconds:.2f} s (traced)")
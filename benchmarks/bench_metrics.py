@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import *
+from symbol import *
+
+ITERATIONS = 1000000
+
+def measure_record(iterations):
+    # the cost a timed stage pays: two clock reads and one histogram record
+    histogram = Histogram()
+    clock = time.perf_counter_ns
+
+    def timed():
+        start = clock()
+        histogram.record(clock() - start)
+
+    def untimed():
+        pass
+
+    # the call timeit makes per iteration is not part of the overhead
+    baseline = min(timeit.repeat(untimed, number=iterations, repeat=3))
+    return (min(timeit.repeat(timed, number=iterations, repeat=3)) - baseline) / iterations
+
+def measure_per_order(iterations):
+    # the instrumentation one ADD pays on an engine thread without a journal, step for step:
+    # the submit stamp, the queue wait record, the timed book add and the two counters. a
+    # journal adds one more timed stage; replies, the stream and the log are not timed per order
+    metrics = Metrics()
+    queue_wait = metrics.histogram(QUEUE_WAIT, PARKER)
+    book_add = metrics.histogram(BOOK_ADD, PARKER)
+    counter = metrics.counter(PARKER)
+    clock = time.perf_counter_ns
+
+    def timed():
+        submitted = clock()
+        queue_wait.record(clock() - submitted)
+        start = clock()
+        book_add.record(clock() - start)
+        counter[ORDERS] += 1
+        counter[FILLS] += 0
+
+    def untimed():
+        pass
+
+    baseline = min(timeit.repeat(untimed, number=iterations, repeat=3))
+    return (min(timeit.repeat(timed, number=iterations, repeat=3)) - baseline) / iterations
+
+def measure_percentiles(samples):
+    rng = random.Random(1)
+    histogram = Histogram()
+    for _ in range(samples):
+        histogram.record(int(rng.expovariate(1 / 5000)))
+    start = time.perf_counter()
+    for fraction in PERCENTILES:
+        histogram.percentile(fraction)
+    return (time.perf_counter() - start) / len(PERCENTILES)
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    print(f"{'timed stage overhead':<24}{measure_record(iterations) * 1e9:8.0f} ns/event")
+    print(f"{'engine overhead':<24}{measure_per_order(iterations) * 1e9:8.0f} ns/order")
+    print(f"{'percentile query':<24}{measure_percentiles(iterations) * 1e6:8.1f} us")
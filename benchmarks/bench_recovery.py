@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import *
+from order_table import *
+from bench_memory import build_book
+
+ORDERS = 1000000
+TAIL = 100000
+LEVELS = 1000
+
+def write_state(directory, orders, tail):
+    book = build_book(orders, LEVELS)
+    journal = Journal(directory, 0)
+    # the book is keyed by (client id, msg id), so each key is its own owner
+    write_snapshot(directory, book, journal.current_seq(), {key : key for key in book.open_orders})
+
+    # a journal tail of non-crossing ADDs written after the snapshot
+    for i in range(tail):
+        side = BUY if i % 2 == 0 else SELL
+        price = 100000 - i % LEVELS if side == BUY else 100001 + i % LEVELS
+        journal.append(ADD, PARKER, 1000 + i % 1000, i, side, price, 10)
+    journal.close()
+
+if __name__ == "__main__":
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else ORDERS
+    tail = int(sys.argv[2]) if len(sys.argv) > 2 else TAIL
+    directory = tempfile.mkdtemp()
+    try:
+        write_state(directory, orders, tail)
+
+        books = {symbol : Book(symbol) for symbol in ALL_SYMBOLS}
+        start = time.perf_counter()
+        last_seq, max_client_id = recover(directory, books, OrderTable())
+        seconds = time.perf_counter() - start
+        assert len(books[PARKER].open_orders) == orders + tail
+
+        print(f"snapshot orders: {str(orders)}")
+        print(f"journal tail:    {str(tail)} records")
+        print(f"recovery time:   {seconds:.2f} s ({(orders + tail) / seconds:.0f} orders/s)")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import queue
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import *
+from engine import *
+from symbol import *
+
+OPEN_ORDERS = [10, 1000, 100000]
+ITERATIONS = 100000
+
+LIMITS = RiskLimits(max_amount=1000, max_notional=1000000000, max_open_orders=10000000,
+                    max_open_amount=1000000000, max_position=1000000000, price_band="0.5")
+
+def resting_engine(open_orders, limits):
+    # one client with open_orders resting bids, none crossing the asks added later
+    engine = MatchingEngine(Book(PARKER), queue.SimpleQueue(), limits=limits)
+    rng = random.Random(1)
+    for i in range(open_orders):
+        engine.handle((ADD, 0, i, i, Order(PARKER, BUY, rng.randint(1000, 4999), 10)))
+    return engine
+
+def measure_check(open_orders, iterations):
+    # the gate alone, for a client with open_orders already resting
+    engine = resting_engine(open_orders, LIMITS)
+    order = Order(PARKER, BUY, 4000, 10)
+    check = engine.risk.check
+    start = time.perf_counter()
+    for _ in range(iterations):
+        check(0, order, 5000)
+    return (time.perf_counter() - start) / iterations
+
+def measure_add(open_orders, iterations, limits):
+    # a resting add and its cancel through the engine, with or without the gate
+    engine = resting_engine(open_orders, limits)
+    orders = [Order(PARKER, BUY, 4000 + i % 100, 10) for i in range(iterations)]
+    start = time.perf_counter()
+    for i in range(iterations):
+        engine.handle((ADD, 0, open_orders + i, open_orders + i, orders[i]))
+        engine.handle((REMOVE, 0, 0, open_orders + i))
+    return (time.perf_counter() - start) / iterations
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    for open_orders in OPEN_ORDERS:
+        check = measure_check(open_orders, iterations)
+        without = measure_add(open_orders, iterations, None)
+        with_gate = measure_add(open_orders, iterations, LIMITS)
+        print(f"{open_orders:>8} open: check {check * 1e9:6.0f} ns, add and cancel {without * 1e9:6.0f} ns "
+              f"without the gate, {with_gate * 1e9:6.0f} ns with it")
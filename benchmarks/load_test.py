@@ -0,0 +1,372 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from order import *
+from symbol import *
+from metrics import *
+
+FRAME_END = b"\n\n"
+PLACED = b"HAS BEEN PLACED WITH ORDER ID"
+UNFILLED = b"UNFILLED AND CANCELLED"
+REJECTED = b"ORDER REJECTED"
+CANNOT_REMOVE = b"CANNOT REMOVE ORDER"
+ALL_REMOVED = b"ORDERS HAVE BEEN REMOVED"
+FILL_NOTICE = b" FILLED:\n"
+FULLY_FILLED = b"HAS BEEN FILLED:"
+MESSAGES_DROPPED = b"MESSAGES DROPPED"
+# the last line of a METRICS reply, which has blank lines of its own
+METRICS_END = b"ORDER ID SLOTS: "
+
+# what an order client sends each turn: an order that rests, a cancel of its oldest open
+# order, or an IOC order priced into the other side of the book
+REST = "REST"
+CANCEL = "CANCEL"
+CROSS = "CROSS"
+ACTIONS = [REST, CANCEL, CROSS]
+
+UNIFORM = "UNIFORM"
+NORMAL = "NORMAL"
+PRICE_DISTRIBUTIONS = set([UNIFORM, NORMAL])
+
+# every symbol is quoted around the same mid, in ticks
+MID = 1000
+
+def percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+def random_add(rng):
+    # bids and asks never overlap so every ADD is answered by exactly one confirmation
+    ticker = rng.choice(ALL_SYMBOLS).ticker
+    if rng.random() < 0.5:
+        return f"ADD-{ticker}|BUY|{rng.randint(1, 100)}|{rng.randint(100, 499) / 100:.2f}\n"
+    return f"ADD-{ticker}|SELL|{rng.randint(1, 100)}|{rng.randint(501, 999) / 100:.2f}\n"
+
+async def read_until_placed(reader):
+    while True:
+        frame = await reader.readuntil(FRAME_END)
+        if PLACED in frame:
+            return
+
+async def run_client(host, port, orders, seed, latencies):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readuntil(FRAME_END)
+
+    for _ in range(orders):
+        line = random_add(rng).encode("utf-8")
+        start = time.perf_counter()
+        writer.write(line)
+        await read_until_placed(reader)
+        latencies.append(time.perf_counter() - start)
+
+    writer.write(b"\n")
+    await writer.drain()
+    writer.close()
+
+async def run(host, port, clients, orders):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, orders, i, latencies) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+class LoadConfig:
+    # the shape of a soak run. mix weights REST, CANCEL and CROSS; prices are drawn at most
+    # width ticks from the mid. a client at max_open open orders cancels instead of resting
+    # more, so the books stay bounded and anything that keeps growing is the server's
+    def __init__(self, clients=10, subscribers=2, slow_subscribers=0, slow_delay=0.01,
+                 mix=(6, 3, 1), prices=UNIFORM, width=50, max_amount=100, max_open=100, rate=0,
+                 symbols=None):
+        assert prices in PRICE_DISTRIBUTIONS and 0 < width < MID
+        self.clients = clients
+        self.subscribers = subscribers
+        self.slow_subscribers = slow_subscribers
+        self.slow_delay = slow_delay
+        self.mix = mix
+        self.prices = prices
+        self.width = width
+        self.max_amount = max_amount
+        self.max_open = max_open
+        # messages per second per client, 0 for as fast as replies come back
+        self.rate = rate
+        self.symbols = symbols if symbols != None else ALL_SYMBOLS
+
+class SoakStats:
+    # everything here is written from the one event loop, so nothing is locked
+    def __init__(self):
+        self.latency = Histogram()
+        self.interval = Histogram()
+        self.sent = {REST: 0, CANCEL: 0, CROSS: 0}
+        self.fills = 0
+        self.rejected = 0
+        self.missed_cancels = 0
+        self.events = 0
+        self.dropped = 0
+        self.subscribers_lost = 0
+
+    def record(self, action, nanoseconds):
+        self.sent[action] += 1
+        self.latency.record(nanoseconds)
+        self.interval.record(nanoseconds)
+
+def price_offset(rng, config):
+    # ticks away from the mid, from 1 to width
+    if config.prices == UNIFORM:
+        return rng.randint(1, config.width)
+    return min(config.width, 1 + int(abs(rng.gauss(0, config.width / 3))))
+
+def choose_action(rng, config, open_orders):
+    action = rng.choices(ACTIONS, config.mix)[0]
+    if action == REST and open_orders >= config.max_open:
+        return CANCEL
+    if action == CANCEL and open_orders == 0:
+        return REST
+    return action
+
+def order_line(rng, config, action):
+    # resting bids sit below the mid and asks above it, so they never trade with each other;
+    # crossing orders reach past the mid and are IOC, so they never rest on the wrong side
+    symbol = rng.choice(config.symbols)
+    side = BUY if rng.random() < 0.5 else SELL
+    offset = price_offset(rng, config)
+    if (side == BUY) == (action == CROSS):
+        price = MID + offset
+    else:
+        price = MID - offset
+    line = f"ADD-{symbol.ticker}|{side}|{str(rng.randint(1, config.max_amount))}|{symbol.format_price(price)}"
+    if action == CROSS:
+        line += f"|{IOC}"
+    return line + "\n"
+
+async def read_answer(reader, open_orders, stats):
+    # fill notices for resting orders arrive whenever someone trades with them; the first
+    # frame that is not one answers the request in flight
+    while True:
+        frame = await reader.readuntil(FRAME_END)
+        if FILL_NOTICE not in frame:
+            return frame
+        stats.fills += 1
+        if FULLY_FILLED in frame:
+            open_orders.pop(int(frame[len(b"ORDER "):frame.index(b":")]), None)
+
+async def soak_client(host, port, config, seed, stats, deadline):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readuntil(FRAME_END)
+
+    # this client's open order ids, oldest first
+    open_orders = {}
+    next_send = time.perf_counter()
+    while time.perf_counter() < deadline:
+        if config.rate > 0:
+            next_send += 1 / config.rate
+            await asyncio.sleep(max(0, next_send - time.perf_counter()))
+
+        action = choose_action(rng, config, len(open_orders))
+        if action == CANCEL:
+            order_id = next(iter(open_orders))
+            del open_orders[order_id]
+            line = f"REMOVE-{str(order_id)}\n"
+        else:
+            line = order_line(rng, config, action)
+
+        start = time.perf_counter_ns()
+        writer.write(line.encode("utf-8"))
+        frame = await read_answer(reader, open_orders, stats)
+        stats.record(action, time.perf_counter_ns() - start)
+
+        if PLACED in frame:
+            if action == REST and UNFILLED not in frame:
+                order_id = int(frame[frame.index(PLACED) + len(PLACED):].split()[0])
+                open_orders[order_id] = True
+        elif REJECTED in frame:
+            stats.rejected += 1
+        elif CANNOT_REMOVE in frame:
+            stats.missed_cancels += 1
+
+    # leave nothing resting, so runs against the same server start from the same books
+    writer.write(b"CANCEL ALL\n")
+    while ALL_REMOVED not in await read_answer(reader, open_orders, stats):
+        pass
+    writer.write(b"\n")
+    await writer.drain()
+    writer.close()
+
+async def subscribe(host, port, delay, stats):
+    # counts stream events until cancelled. a subscriber with a delay reads one event per
+    # delay, so the server has to buffer for it and drop or disconnect once it falls behind
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readuntil(FRAME_END)
+    try:
+        while True:
+            frame = await reader.readuntil(FRAME_END)
+            if frame.endswith(MESSAGES_DROPPED + FRAME_END):
+                stats.dropped += int(frame.split()[0])
+            else:
+                stats.events += 1
+            if delay > 0:
+                await asyncio.sleep(delay)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        stats.subscribers_lost += 1
+    finally:
+        writer.close()
+
+def rss_kb(pid):
+    # resident set size of pid from /proc, None where that cannot be read
+    try:
+        with open(f"/proc/{str(pid)}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+async def server_counters(reader, writer):
+    # the NAME: number lines of a METRICS reply
+    writer.write(b"METRICS\n")
+    data = await reader.readuntil(METRICS_END)
+    data += await reader.readuntil(FRAME_END)
+    counters = {}
+    for line in data.decode("utf-8").split("\n"):
+        name, _, value = line.partition(": ")
+        if value.isdigit():
+            counters[name] = int(value)
+    return counters
+
+# events are what our subscribers have read; drops and disconnects are the server's count, since a
+# slow subscriber only learns of its drops once it has read the backlog queued ahead of them
+REPORT_HEADER = (f"{'SECONDS':>8}{'MSG/S':>9}{'P50 US':>9}{'P99 US':>9}{'MAX US':>9}{'FILLS':>9}"
+                 f"{'EVENTS':>10}{'DROPPED':>9}{'DISC':>6}{'IDS LIVE':>10}{'SLOTS':>9}{'RSS MB':>9}{'GROWTH':>9}")
+
+def report_line(elapsed, interval, histogram, stats, counters, rss, first_rss):
+    rss_string = f"{rss / 1024:.1f}" if rss != None else "-"
+    growth_string = f"{(rss - first_rss) / 1024:+.1f}" if rss != None and first_rss != None else "-"
+    return (f"{elapsed:>8.0f}{histogram.count() / interval:>9.0f}{histogram.percentile(0.5) / 1000:>9.0f}"
+            f"{histogram.percentile(0.99) / 1000:>9.0f}{histogram.max() / 1000:>9.0f}{stats.fills:>9}"
+            f"{stats.events:>10}{counters.get('STREAM EVENTS DROPPED', 0):>9}"
+            f"{counters.get('STREAM SUBSCRIBERS DISCONNECTED', 0):>6}"
+            f"{counters.get('ORDER IDS LIVE', 0):>10}{counters.get('ORDER ID SLOTS', 0):>9}"
+            f"{rss_string:>9}{growth_string:>9}")
+
+async def soak(host, order_port, stream_port, config, duration, report_interval=None, pid=None):
+    # runs config against a live exchange for duration seconds, printing a report line every
+    # report_interval seconds when one is given. pid is the server process whose RSS is
+    # tracked. returns the stats, the seconds taken, the server's counters at the end and
+    # the RSS growth in kB
+    stats = SoakStats()
+    first_rss = rss_kb(pid) if pid != None else None
+    control_reader, control_writer = await asyncio.open_connection(host, order_port)
+    await control_reader.readuntil(FRAME_END)
+
+    subscribers = []
+    for i in range(config.subscribers):
+        delay = config.slow_delay if i < config.slow_subscribers else 0
+        subscribers.append(asyncio.create_task(subscribe(host, stream_port, delay, stats)))
+
+    start = time.perf_counter()
+    deadline = start + duration
+    clients = asyncio.gather(*[soak_client(host, order_port, config, i, stats, deadline)
+                               for i in range(config.clients)])
+    if report_interval != None:
+        print(REPORT_HEADER)
+        last_report = start
+        while not clients.done():
+            await asyncio.wait([clients], timeout=report_interval)
+            if clients.done():
+                break
+            now = time.perf_counter()
+            histogram = stats.interval
+            stats.interval = Histogram()
+            counters = await server_counters(control_reader, control_writer)
+            rss = rss_kb(pid) if pid != None else None
+            print(report_line(now - start, now - last_report, histogram, stats, counters, rss, first_rss))
+            last_report = now
+    await clients
+    elapsed = time.perf_counter() - start
+
+    # whatever the cancels and fills published is given a moment to reach the subscribers
+    await asyncio.sleep(0.5)
+    for subscriber in subscribers:
+        subscriber.cancel()
+    await asyncio.gather(*subscribers, return_exceptions=True)
+
+    counters = await server_counters(control_reader, control_writer)
+    control_writer.write(b"\n")
+    control_writer.close()
+    rss = rss_kb(pid) if pid != None else None
+    growth = rss - first_rss if rss != None and first_rss != None else None
+    return stats, elapsed, counters, growth
+
+def parse_mix(string):
+    mix = tuple([float(weight) for weight in string.split(",")])
+    if len(mix) != len(ACTIONS) or sum(mix) <= 0:
+        raise argparse.ArgumentTypeError("expected REST,CANCEL,CROSS weights")
+    return mix
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="open N local order clients against a running exchange")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--orders", type=int, default=100, help="ADD messages per client")
+
+    soak_group = parser.add_argument_group("soak", "a mixed load for a fixed time instead of --orders ADDs")
+    soak_group.add_argument("--duration", type=float, default=None, help="seconds to run a soak for")
+    soak_group.add_argument("--stream-port", type=int, default=None, help="the exchange's stream port, for subscribers")
+    soak_group.add_argument("--subscribers", type=int, default=2)
+    soak_group.add_argument("--slow-subscribers", type=int, default=0, help="how many subscribers read slowly")
+    soak_group.add_argument("--slow-delay-ms", type=float, default=10, help="what a slow subscriber waits per event")
+    soak_group.add_argument("--mix", type=parse_mix, default=(6, 3, 1), help="REST,CANCEL,CROSS weights")
+    soak_group.add_argument("--prices", choices=sorted(PRICE_DISTRIBUTIONS), default=UNIFORM, type=str.upper,
+                            help="how far from the mid prices are drawn")
+    soak_group.add_argument("--width", type=int, default=50, help="most ticks an order is priced from the mid")
+    soak_group.add_argument("--max-amount", type=int, default=100)
+    soak_group.add_argument("--max-open", type=int, default=100, help="open orders per client before it only cancels")
+    soak_group.add_argument("--rate", type=float, default=0, help="messages per second per client, 0 for no limit")
+    soak_group.add_argument("--report-every", type=float, default=10, help="seconds between report lines")
+    soak_group.add_argument("--pid", type=int, default=None, help="the exchange's process id, to track its RSS")
+    args = parser.parse_args()
+
+    if args.duration == None:
+        latencies, elapsed = asyncio.run(run(args.host, args.port, args.clients, args.orders))
+        latencies.sort()
+
+        print(f"clients:    {str(args.clients)}")
+        print(f"messages:   {str(len(latencies))}")
+        print(f"throughput: {len(latencies) / elapsed:.0f} msg/s")
+        print(f"p50:        {percentile(latencies, 0.50) * 1e6:.0f} us")
+        print(f"p99:        {percentile(latencies, 0.99) * 1e6:.0f} us")
+    else:
+        if args.stream_port == None and args.subscribers > 0:
+            parser.error("--stream-port is needed for subscribers")
+        config = LoadConfig(args.clients, args.subscribers, args.slow_subscribers, args.slow_delay_ms / 1000,
+                            args.mix, args.prices, args.width, args.max_amount, args.max_open, args.rate)
+        stats, elapsed, counters, growth = asyncio.run(soak(args.host, args.port, args.stream_port, config,
+                                                            args.duration, args.report_every, args.pid))
+        histogram = stats.latency
+
+        print()
+        print(f"clients:     {str(args.clients)}, subscribers: {str(args.subscribers)} ({str(args.slow_subscribers)} slow)")
+        print(f"messages:    {str(histogram.count())} ({', '.join([f'{str(stats.sent[action])} {action}' for action in ACTIONS])})")
+        print(f"throughput:  {histogram.count() / elapsed:.0f} msg/s")
+        print(f"p50:         {histogram.percentile(0.50) / 1000:.0f} us")
+        print(f"p99:         {histogram.percentile(0.99) / 1000:.0f} us")
+        print(f"p99.9:       {histogram.percentile(0.999) / 1000:.0f} us")
+        print(f"fills:       {str(stats.fills)}, rejected: {str(stats.rejected)}, missed cancels: {str(stats.missed_cancels)}")
+        print(f"subscribers: {str(stats.events)} events read, {str(stats.dropped)} reported dropped, "
+              f"{str(stats.subscribers_lost)} connections lost")
+        print(f"server:      {str(counters.get('STREAM EVENTS DROPPED', 0))} events dropped, "
+              f"{str(counters.get('STREAM SUBSCRIBERS DISCONNECTED', 0))} subscribers disconnected, "
+              f"{str(counters.get('ORDER IDS LIVE', 0))} order ids live in {str(counters.get('ORDER ID SLOTS', 0))} slots")
+        if growth != None:
+            print(f"rss growth:  {growth / 1024:+.1f} MB")
@@ -0,0 +1,278 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import datetime
+import threading
+import contextlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from book import *
+from exchange import *
+from message import *
+
+import load_test
+import bench_fills
+import bench_metrics
+import bench_risk
+
+DEPTHS = [100, 1000, 10000, 100000]
+INSERTS = 10000
+SWEEP_LEVELS = 10000
+CANCELS = 100000
+CODEC_ITERATIONS = 100000
+METRICS_ITERATIONS = 1000000
+RISK_ITERATIONS = 100000
+BOOK_POLL_DEPTH = 10000
+BOOK_POLLS = 1000
+E2E_ORDERS = 2000
+MIXED_CLIENTS = 10
+MIXED_SUBSCRIBERS = 2
+MIXED_SECONDS = 10
+WORKER_COUNTS = [1, 2, 4]
+WORKER_CLIENTS = 20
+WORKER_ORDERS = 200
+
+def resting_book(depth, rng):
+    # depth resting orders spread over many levels on both sides, none crossing
+    book = Book(PARKER)
+    for i in range(depth):
+        if i % 2 == 0:
+            book.add(Order(PARKER, BUY, rng.randint(1, 49999), 10), (0, i))
+        else:
+            book.add(Order(PARKER, SELL, rng.randint(50001, 99999), 10), (0, i))
+    return book
+
+def bench_add_vs_depth(quick):
+    rng = random.Random(1)
+    results = {}
+    for depth in DEPTHS[:2] if quick else DEPTHS:
+        book = resting_book(depth, rng)
+        orders = [Order(PARKER, BUY if i % 2 == 0 else SELL, rng.randint(1, 49999) if i % 2 == 0 else rng.randint(50001, 99999), 10)
+                  for i in range(INSERTS)]
+        start = time.perf_counter()
+        for i in range(INSERTS):
+            book.add(orders[i], (1, i))
+        results[f"depth_{str(depth)}_ns_per_add"] = (time.perf_counter() - start) / INSERTS * 1e9
+    return results
+
+def bench_sweep(quick):
+    levels = SWEEP_LEVELS // 10 if quick else SWEEP_LEVELS
+    blocks, size = bench_fills.measure_allocations(levels)
+    return {"levels": levels,
+            "ns_per_fill": bench_fills.measure_time(levels) * 1e9,
+            "blocks_per_fill": blocks,
+            "bytes_per_fill": size}
+
+def bench_cancels(quick):
+    rng = random.Random(2)
+    count = CANCELS // 10 if quick else CANCELS
+    book = resting_book(count, rng)
+    order_ids = list(book.open_orders.keys())
+    rng.shuffle(order_ids)
+    start = time.perf_counter()
+    for order_id in order_ids:
+        book.remove(order_id)
+    remove_seconds = time.perf_counter() - start
+
+    # requoting: every add is followed by cancelling an older resting order
+    book = resting_book(count, rng)
+    live = list(book.open_orders.keys())
+    start = time.perf_counter()
+    for i in range(count):
+        book.add(Order(PARKER, BUY, rng.randint(1, 49999), 10), (2, i))
+        live.append((2, i))
+        book.remove(live.pop(rng.randrange(len(live))))
+    churn_seconds = time.perf_counter() - start
+
+    return {"orders": count,
+            "ns_per_remove": remove_seconds / count * 1e9,
+            "ns_per_add_and_cancel": churn_seconds / count * 1e9}
+
+def bench_codec(quick):
+    iterations = CODEC_ITERATIONS // 10 if quick else CODEC_ITERATIONS
+    msg = Message(ADD, Order(PARKER, BUY, PARKER.to_ticks("4.95"), 25))
+    text = msg.serialize()
+    record = msg.pack()
+    cases = {"text_serialize": msg.serialize,
+             "text_deserialize": lambda: Message.deserialize(text),
+             "binary_pack": msg.pack,
+             "binary_unpack": lambda: Message.unpack(record)}
+
+    results = {}
+    for name in cases:
+        func = cases[name]
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        results[f"{name}_msgs_per_s"] = iterations / (time.perf_counter() - start)
+    return results
+
+def bench_metrics_overhead(quick):
+    iterations = METRICS_ITERATIONS // 10 if quick else METRICS_ITERATIONS
+    return {"ns_per_timed_event": bench_metrics.measure_record(iterations) * 1e9,
+            "ns_per_order": bench_metrics.measure_per_order(iterations) * 1e9,
+            "us_per_percentile": bench_metrics.measure_percentiles(iterations) * 1e6}
+
+def bench_risk_check(quick):
+    iterations = RISK_ITERATIONS // 10 if quick else RISK_ITERATIONS
+    results = {}
+    for open_orders in bench_risk.OPEN_ORDERS[:2] if quick else bench_risk.OPEN_ORDERS:
+        results[f"open_{str(open_orders)}_ns_per_check"] = bench_risk.measure_check(open_orders, iterations) * 1e9
+        results[f"open_{str(open_orders)}_ns_per_add_cancel"] = bench_risk.measure_add(open_orders, iterations, None) * 1e9
+        results[f"open_{str(open_orders)}_ns_per_add_cancel_gated"] = bench_risk.measure_add(open_orders, iterations, bench_risk.LIMITS) * 1e9
+    return results
+
+def bench_book_poll(quick):
+    # repeated BOOK requests against an unchanged book: what the engine spends on each,
+    # and what the output thread spends rendering a new version or reusing a cached one
+    depth = BOOK_POLL_DEPTH // 10 if quick else BOOK_POLL_DEPTH
+    polls = BOOK_POLLS // 10 if quick else BOOK_POLLS
+    outbox = queue.SimpleQueue()
+    book = resting_book(depth, random.Random(3))
+    engine = MatchingEngine(book, outbox, owners={key : key for key in book.open_orders})
+    server = Exchange_Server("localhost", 0, 0, io.StringIO(), False)
+
+    start = time.perf_counter()
+    for i in range(polls):
+        engine.handle((BOOK, 0, i, 0, 1, None))
+    engine_seconds = time.perf_counter() - start
+
+    results = [outbox.get() for _ in range(polls)]
+    start = time.perf_counter()
+    server.rendered_book(*results[0][5:])
+    render_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for result in results[1:]:
+        server.rendered_book(*result[5:])
+    cached_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    str(engine.book)
+    full_seconds = time.perf_counter() - start
+    return {"orders": depth,
+            "engine_us_per_poll": engine_seconds / polls * 1e6,
+            "render_us": render_seconds * 1e6,
+            "cached_us_per_poll": cached_seconds / (polls - 1) * 1e6,
+            "str_book_us": full_seconds * 1e6}
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def start_server(workers=0):
+    # an in-process exchange on free ports, returned once it accepts connections
+    order_port = free_port()
+    stream_port = free_port()
+    server = Exchange_Server("localhost", order_port, stream_port, io.StringIO(), False, workers=workers)
+    threading.Thread(target=server.serve, daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", order_port)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    return order_port, stream_port
+
+def bench_end_to_end(quick):
+    orders = E2E_ORDERS // 10 if quick else E2E_ORDERS
+    order_port, _ = start_server()
+
+    latencies, elapsed = asyncio.run(load_test.run("localhost", order_port, 1, orders))
+    latencies.sort()
+    return {"orders": orders,
+            "msgs_per_s": len(latencies) / elapsed,
+            "p50_us": load_test.percentile(latencies, 0.50) * 1e6,
+            "p99_us": load_test.percentile(latencies, 0.99) * 1e6}
+
+def bench_mixed_load(quick):
+    # rests, cancels and crosses from several clients with stream subscribers attached; the
+    # server shares this process, so rss growth includes the load generator's
+    order_port, stream_port = start_server()
+    config = load_test.LoadConfig(clients=MIXED_CLIENTS, subscribers=MIXED_SUBSCRIBERS)
+    duration = MIXED_SECONDS / 5 if quick else MIXED_SECONDS
+    stats, elapsed, counters, growth = asyncio.run(load_test.soak("localhost", order_port, stream_port,
+                                                                  config, duration, pid=os.getpid()))
+    return {"seconds": duration,
+            "msgs_per_s": stats.latency.count() / elapsed,
+            "p50_us": stats.latency.percentile(0.50) / 1000,
+            "p99_us": stats.latency.percentile(0.99) / 1000,
+            "fills": stats.fills,
+            "stream_events": stats.events,
+            "stream_dropped": counters.get("STREAM EVENTS DROPPED", 0),
+            "order_ids_live": counters.get("ORDER IDS LIVE", 0),
+            "order_id_slots": counters.get("ORDER ID SLOTS", 0),
+            "rss_growth_kb": growth}
+
+def bench_workers(quick):
+    # the same load with the books in 1 and in more worker processes. workers only add
+    # throughput with a core each to run on, so the core count is part of the result
+    orders = WORKER_ORDERS // 10 if quick else WORKER_ORDERS
+    results = {"cpus": os.cpu_count(), "clients": WORKER_CLIENTS, "orders_per_client": orders}
+    for workers in WORKER_COUNTS:
+        order_port, _ = start_server(workers)
+        # the first orders wait for the workers to spawn, so they are not timed
+        asyncio.run(load_test.run("localhost", order_port, 1, 10))
+        latencies, elapsed = asyncio.run(load_test.run("localhost", order_port, WORKER_CLIENTS, orders))
+        latencies.sort()
+        results[f"workers_{str(workers)}_msgs_per_s"] = len(latencies) / elapsed
+        results[f"workers_{str(workers)}_p99_us"] = load_test.percentile(latencies, 0.99) * 1e6
+    return results
+
+BENCHMARKS = {"book_add_vs_depth": bench_add_vs_depth,
+              "match_sweep": bench_sweep,
+              "cancel_heavy": bench_cancels,
+              "message_codec": bench_codec,
+              "metrics_overhead": bench_metrics_overhead,
+              "risk_check": bench_risk_check,
+              "book_poll": bench_book_poll,
+              "end_to_end_add": bench_end_to_end,
+              "mixed_load": bench_mixed_load,
+              "worker_scaling": bench_workers}
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the benchmark suite and write the results as JSON")
+    parser.add_argument("--output", default=None, help="file to write, defaults to stdout")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads for a fast smoke run")
+    args = parser.parse_args()
+
+    results = {}
+    # the in-process server prints connection notices; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in args.only or BENCHMARKS:
+            print(f"running {name}")
+            results[name] = BENCHMARKS[name](args.quick)
+
+    report = {"revision": git_revision(),
+              "timestamp": datetime.datetime.now().isoformat(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "quick": args.quick,
+              "results": results}
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == None:
+        print(output)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
@@ -1,48 +1,55 @@
 import symbol
 
 from order import *
+from fill import *
 
 from linked_list import *
+from price_levels import *
 
 class Book:
-    def __init__(self, symbol):
+    # with track_depth the book remembers which price levels changed, so a depth feed
+    # can be built from take_depth_update without walking the whole book
+    def __init__(self, symbol, track_depth=False):
         self.symbol = symbol
-        self.bids = LinkedList()
-        self.asks = LinkedList()
+        self.bids = PriceLevels(descending=True, track_changes=track_depth)
+        self.asks = PriceLevels(descending=False, track_changes=track_depth)
 
         self.open_orders = {}
+        self.track_depth = track_depth
+        self.depth_seq = 0
+        # bumped by every change to the resting orders, so a rendering can be reused until it moves
+        self.version = 0
 
     def add(self, order, order_id):
+        # returns the fills. any amount that neither fills nor rests is dropped, which
+        # the caller can tell by the order not being open afterwards
+        if order.type == LIMIT:
+            self.rest(order, order_id)
+            return self.match(order.side)
+        elif order.type == POST:
+            if not self.crosses(order):
+                self.rest(order, order_id)
+            return []
+        elif order.type == FOK and self.fillable(order) < order.amount:
+            return []
+        # the rest never rest, so they are matched without touching this side of the book
+        return self.take(order, order_id)
+
+    def rest(self, order, order_id):
+        # inserts without matching; only for orders known not to cross, such as a reloaded snapshot
         assert order.symbol == self.symbol
 
         order_node = LinkedListNode(order_id, order)
 
         if order.side == BUY:
-            current_node = self.bids.head
-            while current_node != None:
-                if order_node.value.price > current_node.value.price:
-                    self.bids.add_before(order_node, current_node)
-                    break
-                current_node = current_node.next
-            if current_node == None:
-                self.bids.append_back(order_node)
-
+            self.bids.add(order_node)
         elif order.side == SELL:
-            current_node = self.asks.head
-            while current_node != None:
-                if order_node.value.price < current_node.value.price:
-                    self.asks.add_before(order_node, current_node)
-                    break
-                current_node = current_node.next
-            if current_node == None:
-                self.asks.append_back(order_node)
-
+            self.asks.add(order_node)
         else:
             raise ValueError("INVALID ORDER SIDE")
 
         self.open_orders[order_id] = order_node
-
-        return self.match(order.side)
+        self.version += 1
 
     def remove(self, order_id):
         if order_id not in self.open_orders:
@@ -58,10 +65,61 @@ class Book:
             raise ValueError("INVALID ORDER SIDE")
 
         del self.open_orders[order_id]
+        self.version += 1
+        return order_node_to_remove.value
+
+    def accepts(self, order, price):
+        # whether order will trade with a resting order at price
+        if order.price == None:
+            return True
+        if order.side == BUY:
+            return price <= order.price
+        return price >= order.price
+
+    def crosses(self, order):
+        opposite = self.asks if order.side == BUY else self.bids
+        best_price = opposite.best_price()
+        return best_price != None and self.accepts(order, best_price)
+
+    def fillable(self, order):
+        # how much of order could fill right now, counting no further than its amount
+        opposite = self.asks if order.side == BUY else self.bids
+        available = 0
+        for price in opposite.prices():
+            if available >= order.amount or not self.accepts(order, price):
+                break
+            available += opposite.volume(price)
+        return available
+
+    def take(self, order, order_id):
+        # matches an order against the opposite side without ever inserting it. a market
+        # order trades at each maker's price, anything else at its own price like match
+        opposite = self.asks if order.side == BUY else self.bids
+        filled_orders = []
+        remaining = order.amount
+        while remaining > 0:
+            maker = opposite.best()
+            if maker == None or not self.accepts(order, maker.value.price):
+                break
+
+            fill_size = min(remaining, maker.value.amount)
+            strike_price = maker.value.price if order.price == None else order.price
+            remaining -= fill_size
+            filled_orders.append(Fill(self.symbol, order.side, maker.key, order_id,
+                                      maker.value.price, order.price, strike_price, fill_size,
+                                      maker.value.amount - fill_size, remaining))
+
+            if maker.value.amount > fill_size:
+                opposite.reduce(maker, fill_size)
+            else:
+                self.remove(maker.key)
+        if len(filled_orders) > 0:
+            self.version += 1
+        return filled_orders
 
     def match(self, side):
-        best_bid = self.bids.head
-        best_ask = self.asks.head
+        best_bid = self.bids.best()
+        best_ask = self.asks.best()
 
         if best_bid == None or best_ask == None:
             return []
@@ -73,25 +131,25 @@ class Book:
         while best_bid_order.price >= best_ask_order.price:
             if side == BUY:
                 strike_price = best_bid_order.price
+                taker, maker = best_bid, best_ask
             elif side == SELL:
                 strike_price = best_ask_order.price
+                taker, maker = best_ask, best_bid
             else:
                 raise ValueError("INVALID ORDER SIDE")
 
             fill_size = min(best_bid_order.amount, best_ask_order.amount)
-            
-            filled_bid = Order(best_bid_order.symbol, BUY, strike_price, fill_size)
-            filled_orders.append((best_bid.key, best_bid_order.copy(), filled_bid))
-            
-            filled_ask = Order(best_ask_order.symbol, SELL, strike_price, fill_size)
-            filled_orders.append((best_ask.key, best_ask_order.copy(), filled_ask))
-            
+
+            filled_orders.append(Fill(self.symbol, side, maker.key, taker.key,
+                                      maker.value.price, taker.value.price, strike_price, fill_size,
+                                      maker.value.amount - fill_size, taker.value.amount - fill_size))
+
             should_break = False
             if best_bid_order.amount > fill_size:
-                best_bid_order.amount -= fill_size
+                self.bids.reduce(best_bid, fill_size)
             else:
                 self.remove(best_bid.key)
-                best_bid = self.bids.head
+                best_bid = self.bids.best()
                 # the list may now be empty
                 if best_bid == None:
                     should_break = True
@@ -99,10 +157,10 @@ class Book:
                     best_bid_order = best_bid.value
 
             if best_ask_order.amount > fill_size:
-                best_ask_order.amount -= fill_size
+                self.asks.reduce(best_ask, fill_size)
             else:
                 self.remove(best_ask.key)
-                best_ask = self.asks.head
+                best_ask = self.asks.best()
                 # the list may now be empty
                 if best_ask == None:
                     should_break = True
@@ -111,77 +169,87 @@ class Book:
             if should_break:
                 break
 
+        # partial fills change amounts without a rest or remove
+        self.version += 1
         return filled_orders
 
-    def get_open_order(self, order_id):
-        return self.open_orders[order_id].value
-
-    def __str__(self):
-        output = [f"{str(self.symbol)}:"]
-
-        bid_strings = []
-        bid_max_length = 0
-        current_node = self.bids.head
-        while current_node != None:
-            current_order = current_node.value
-            bid_price = current_order.price
-            bid_amount = current_order.amount
-
-            # quad spaces used here to avoid length differences due to different tab lengths
-            line_string = f"{str(bid_amount)}    ${str(bid_price)}"
-            bid_max_length = max(bid_max_length, len(line_string))
-            bid_strings.append(line_string)
-
-            current_node = current_node.next
-
-        for i in range(len(bid_strings)):
-            bid_strings[i] += " " * (bid_max_length - len(bid_strings[i]))
-
-        ask_strings = []
-        ask_max_length = 0
-        current_node = self.asks.head
-        while current_node != None:
-            current_order = current_node.value
-            ask_price = current_order.price
-            ask_amount = current_order.amount
-
-            # quad spaces used her to avoid length differences due to different tab lengths
-            line_string = f"${str(ask_price)}    {str(ask_amount)}"
-            ask_max_length = max(ask_max_length, len(line_string))
-            ask_strings.append(line_string)
-
-            current_node = current_node.next
+    def take_depth_update(self):
+        # returns the next depth seq and the changed levels as (side, price, total amount),
+        # or None when no level has changed since the last update
+        changes = [(BUY, price, volume) for price, volume in self.bids.take_changes()]
+        changes += [(SELL, price, volume) for price, volume in self.asks.take_changes()]
+        if len(changes) == 0:
+            return None
+        self.depth_seq += 1
+        return self.depth_seq, changes
 
-        for i in range(len(ask_strings)):
-            ask_strings[i] += " " * (ask_max_length - len(ask_strings[i]))
+    def depth(self, levels=None):
+        return self.bids.depth(levels), self.asks.depth(levels)
 
-        min_length = min(len(bid_strings), len(ask_strings))
-        
-        for i in range(min_length):
-            line_string = f"{bid_strings[i]} | {ask_strings[i]}"
-            output.append(line_string)
-
-        for i in range(min_length, len(bid_strings)):
-            line_string = f"{bid_strings[i]} | "
-            output.append(line_string)
+    def get_open_order(self, order_id):
+        return self.open_orders[order_id].value
 
-        empty_bid = " " * bid_max_length
-        for i in range(min_length, len(ask_strings)):
-            line_string = f"{empty_bid} | {ask_strings[i]}"
-            output.append(line_string)
+    def snapshot(self, levels=None):
+        # (amount, price) for every order resting in the best levels of each side, for
+        # rendering away from the engine
+        return self.bids.orders(levels), self.asks.orders(levels)
 
-        return "\n".join(output)
+    def __str__(self):
+        return render_book(self.symbol, *self.snapshot())
 
     def __repr__(self):
         return str(self)
 
+def render_book(symbol, bids, asks):
+    # bids and asks are (amount, price) for each resting order, as Book.snapshot returns them
+    output = [f"{str(symbol)}:"]
+
+    bid_strings = []
+    bid_max_length = 0
+    for bid_amount, bid_price in bids:
+        # quad spaces used here to avoid length differences due to different tab lengths
+        line_string = f"{str(bid_amount)}    ${symbol.format_price(bid_price)}"
+        bid_max_length = max(bid_max_length, len(line_string))
+        bid_strings.append(line_string)
+
+    for i in range(len(bid_strings)):
+        bid_strings[i] += " " * (bid_max_length - len(bid_strings[i]))
+
+    ask_strings = []
+    ask_max_length = 0
+    for ask_amount, ask_price in asks:
+        # quad spaces used her to avoid length differences due to different tab lengths
+        line_string = f"${symbol.format_price(ask_price)}    {str(ask_amount)}"
+        ask_max_length = max(ask_max_length, len(line_string))
+        ask_strings.append(line_string)
+
+    for i in range(len(ask_strings)):
+        ask_strings[i] += " " * (ask_max_length - len(ask_strings[i]))
+
+    min_length = min(len(bid_strings), len(ask_strings))
+    
+    for i in range(min_length):
+        line_string = f"{bid_strings[i]} | {ask_strings[i]}"
+        output.append(line_string)
+
+    for i in range(min_length, len(bid_strings)):
+        line_string = f"{bid_strings[i]} | "
+        output.append(line_string)
+
+    empty_bid = " " * bid_max_length
+    for i in range(min_length, len(ask_strings)):
+        line_string = f"{empty_bid} | {ask_strings[i]}"
+        output.append(line_string)
+
+    return "\n".join(output)
+
 if __name__ == "__main__":
-    bid_1 = Order(symbol.PARKER, BUY, 5, 20)
-    bid_2 = Order(symbol.PARKER, BUY, 4.95, 25)
-    bid_3 = Order(symbol.PARKER, BUY, 5.50, 25)
+    bid_1 = Order(symbol.PARKER, BUY, symbol.PARKER.to_ticks("5"), 20)
+    bid_2 = Order(symbol.PARKER, BUY, symbol.PARKER.to_ticks("4.95"), 25)
+    bid_3 = Order(symbol.PARKER, BUY, symbol.PARKER.to_ticks("5.50"), 25)
 
-    ask_1 = Order(symbol.PARKER, SELL, 5.1, 15)
-    ask_2 = Order(symbol.PARKER, SELL, 5.50, 7)
+    ask_1 = Order(symbol.PARKER, SELL, symbol.PARKER.to_ticks("5.1"), 15)
+    ask_2 = Order(symbol.PARKER, SELL, symbol.PARKER.to_ticks("5.50"), 7)
 
     # bid = Order(symbol.PARKER, BUY, 20, 10)
     # ask = Order(symbol.PARKER, SELL, 20, 10)
@@ -191,4 +259,46 @@ if __name__ == "__main__":
     for i in range(len(orders)):
         filled = book.add(orders[i], i)
         print(filled)
-        print(book)
\ No newline at end of file
+        print(book)
+
+    # every change to the resting orders moves the version, partial fills included
+    version = book.version
+    book.add(Order(symbol.PARKER, SELL, symbol.PARKER.to_ticks("5.50"), 1), 5)
+    assert book.version > version
+    bids, asks = book.snapshot(1)
+    assert bids == [(2, symbol.PARKER.to_ticks("5.50"))] and asks == []
+    assert render_book(book.symbol, *book.snapshot()) == str(book)
+
+    # a depth view rebuilt only from the updates always matches the book's own depth
+    import random
+    rng = random.Random(0)
+    book = Book(symbol.PARKER, track_depth=True)
+    view = {BUY: {}, SELL: {}}
+    for i in range(5000):
+        if len(book.open_orders) > 0 and rng.random() < 0.3:
+            book.remove(rng.choice(list(book.open_orders.keys())))
+        else:
+            book.add(Order(symbol.PARKER, rng.choice([BUY, SELL]), rng.randint(90, 110), rng.randint(1, 20)), i)
+        update = book.take_depth_update()
+        if update != None:
+            for side, price, volume in update[1]:
+                if volume == 0:
+                    view[side].pop(price, None)
+                else:
+                    view[side][price] = volume
+        bids, asks = book.depth()
+        assert sorted(view[BUY].items(), reverse=True) == bids
+        assert sorted(view[SELL].items()) == asks
+
+    # every order type leaves the same book a plain limit order would, apart from what it drops
+    book = Book(symbol.PARKER)
+    book.add(Order(symbol.PARKER, SELL, 101, 5), "a")
+    book.add(Order(symbol.PARKER, SELL, 102, 5), "b")
+    assert book.add(Order(symbol.PARKER, BUY, 101, 8, FOK), "fok") == []
+    assert book.add(Order(symbol.PARKER, BUY, 101, 3, POST), "post") == [] and "post" not in book.open_orders
+    fills = book.add(Order(symbol.PARKER, BUY, 102, 8, IOC), "ioc")
+    assert [fill.amount for fill in fills] == [5, 3] and "ioc" not in book.open_orders
+    fills = book.add(Order(symbol.PARKER, BUY, None, 10, MARKET), "market")
+    assert [(fill.price, fill.amount) for fill in fills] == [(102, 2)]
+    assert len(book.open_orders) == 0
+    assert book.add(Order(symbol.PARKER, BUY, 100, 3, POST), "post") == [] and "post" in book.open_orders
@@ -0,0 +1,281 @@
+import time
+import queue
+import threading
+
+from book import *
+from journal import *
+from message import *
+from metrics import *
+from risk import *
+
+DEPTH = "DEPTH"
+DEPTH_SNAPSHOT = "DEPTH SNAPSHOT"
+CANCEL_CLIENT = "CANCEL CLIENT"
+TRADING = "TRADING"
+
+# why orders were cancelled without their owner asking
+ON_DISCONNECT = "ON DISCONNECT"
+SYMBOL_RETIRED = "SYMBOL RETIRED"
+
+# depth updates for a book between two full depth snapshots
+DEPTH_SNAPSHOT_UPDATES = 1000
+
+class MatchingEngine:
+    # the single writer for one Book: commands are applied strictly in arrival order
+    # and every outcome is handed to the outbox instead of being sent from here.
+    # with a journal, each ADD and REMOVE is appended before it is applied. for a book that
+    # tracks depth, the levels each command changed follow its result as a DEPTH update.
+    # with limits, every order passes a RiskGate first and refused orders never reach the journal.
+    # the book is keyed by the exchange's dense order keys; owners gives the client id and msg id
+    # for the keys of any orders already resting in book
+    def __init__(self, book, outbox, journal=None, metrics=None, limits=None, owners=None):
+        self.book = book
+        self.outbox = outbox
+        self.journal = journal
+        self.updates_since_snapshot = 0
+        # a retired symbol's book is emptied and takes no new orders until trading resumes
+        self.trading = True
+        # the book version last snapshotted for BOOK, and the level counts sent at that version.
+        # results reach the output thread in order, so it already holds a rendering for those
+        self.rendered_version = None
+        self.rendered_levels = set()
+
+        # key -> (client id, msg id), and client id -> {msg id: node}, for every resting order
+        self.owners = {}
+        self.client_orders = {}
+        self.risk = RiskGate(book.symbol, limits) if limits != None else None
+        for key in book.open_orders:
+            client_id, msg_id = owners[key]
+            self.index_add(client_id, msg_id, key)
+            if self.risk != None:
+                order = book.open_orders[key].value
+                self.risk.on_rest(client_id, order.side, order.amount)
+
+        # histograms and counters for this symbol are only ever written from this engine
+        self.metrics = metrics
+        if metrics != None:
+            self.queue_wait = metrics.histogram(QUEUE_WAIT, book.symbol)
+            self.book_add = metrics.histogram(BOOK_ADD, book.symbol)
+            self.book_remove = metrics.histogram(BOOK_REMOVE, book.symbol)
+            self.journal_append = metrics.histogram(JOURNAL_APPEND, book.symbol)
+            self.counter = metrics.counter(book.symbol)
+
+    def handle(self, command):
+        typ = command[0]
+        if typ == ADD:
+            _, client_id, msg_id, key, order = command
+            filled_orders, dropped, rests, error = self.place(client_id, msg_id, key, order)
+            self.outbox.put((ADD, client_id, msg_id, key, order, filled_orders, dropped, rests, error))
+            self.publish_depth()
+
+        elif typ == REMOVE:
+            _, client_id, msg_id, order_id = command
+            order, error = self.apply_remove(client_id, order_id)
+            self.outbox.put((REMOVE, client_id, msg_id, order_id, order, error))
+            if error == None:
+                self.publish_depth()
+
+        elif typ == BULK_ADD:
+            # the whole batch is applied in one turn and its levels go out as one depth update
+            _, client_id, msg_id, position, total, orders = command
+            results = [(order_id, key, order) + self.place(client_id, order_id, key, order) for order_id, key, order in orders]
+            self.outbox.put((BULK_ADD, client_id, msg_id, position, total, results))
+            self.publish_depth()
+
+        elif typ == BULK_REMOVE:
+            _, client_id, msg_id, position, total, order_ids = command
+            results = [(order_id,) + self.apply_remove(client_id, order_id) for order_id in order_ids]
+            self.outbox.put((BULK_REMOVE, client_id, msg_id, position, total, results))
+            self.publish_depth()
+
+        elif typ == BOOK:
+            _, client_id, msg_id, position, total, levels = command
+            self.outbox.put((BOOK, client_id, msg_id, position, total, self.book.symbol) + self.book_snapshot(levels))
+
+        elif typ == MY_ORDERS:
+            _, client_id, msg_id, position, total = command
+            orders = self.client_orders.get(client_id, {})
+            lines = [(order_id, f"ORDER {str(order_id)}: {str(orders[order_id].value)}") for order_id in orders]
+            self.outbox.put((MY_ORDERS, client_id, msg_id, position, total, lines))
+
+        elif typ == CANCEL_CLIENT:
+            _, client_id = command
+            removed = self.cancel_client(client_id)
+            if len(removed) > 0:
+                self.outbox.put((CANCEL_CLIENT, client_id, removed, ON_DISCONNECT))
+                self.publish_depth()
+
+        elif typ == TRADING:
+            _, self.trading = command
+            if not self.trading:
+                for client_id in list(self.client_orders):
+                    self.outbox.put((CANCEL_CLIENT, client_id, self.cancel_client(client_id), SYMBOL_RETIRED))
+                self.publish_depth()
+
+        elif typ == CANCEL_ALL:
+            _, client_id, msg_id, position, total = command
+            removed = self.cancel_client(client_id)
+            self.outbox.put((CANCEL_ALL, client_id, msg_id, position, total, removed))
+            self.publish_depth()
+
+        elif typ == SNAPSHOT:
+            # every journal record for this book up to seq has already been applied
+            seq = self.journal.current_seq()
+            write_snapshot(self.journal.directory, self.book, seq, self.owners)
+            self.outbox.put((SNAPSHOT, self.book.symbol, seq))
+
+        elif typ == DEPTH_SNAPSHOT:
+            _, subscriber_id = command
+            self.publish_depth_snapshot(subscriber_id)
+
+        else:
+            raise ValueError("INVALID COMMAND TYPE")
+
+    def place(self, client_id, msg_id, key, order):
+        # returns the fills, the amount dropped, whether the order rests and why the order was
+        # refused, if it was
+        if not self.trading:
+            return [], order.amount, False, None
+        if self.risk != None:
+            opposite = self.book.asks if order.side == BUY else self.book.bids
+            error = self.risk.check(client_id, order, opposite.best_price())
+            if error != None:
+                return [], 0, False, error
+        return self.apply_add(client_id, msg_id, key, order) + (None,)
+
+    def apply_add(self, client_id, msg_id, key, order):
+        # returns the fills, the amount that was dropped, neither filled nor resting, and
+        # whether any of the order rests under key
+        if self.journal != None:
+            start = time.perf_counter_ns()
+            self.journal.append(ADD, order.symbol, client_id, msg_id, order.side, order.price, order.amount, order.type)
+            if self.metrics != None:
+                self.journal_append.record(time.perf_counter_ns() - start)
+            self.check_checkpoint()
+
+        start = time.perf_counter_ns()
+        filled_orders = self.book.add(order.copy(), key)
+        if self.metrics != None:
+            self.book_add.record(time.perf_counter_ns() - start)
+            self.counter[ORDERS] += 1
+            self.counter[FILLS] += len(filled_orders)
+
+        dropped = 0
+        resting = 0
+        if key in self.book.open_orders:
+            self.index_add(client_id, msg_id, key)
+            resting = self.book.open_orders[key].value.amount
+        elif len(filled_orders) == 0:
+            dropped = order.amount
+        else:
+            dropped = filled_orders[-1].taker_remaining
+        if self.risk != None:
+            self.risk.on_add(client_id, order, filled_orders, resting, self.owners)
+        for fill in filled_orders:
+            if fill.maker_remaining == 0:
+                self.index_discard(fill.maker_id)
+        return filled_orders, dropped, resting > 0
+
+    def apply_remove(self, client_id, order_id):
+        # returns the removed order and None, or None and the reason it could not be removed
+        if self.journal != None:
+            start = time.perf_counter_ns()
+            self.journal.append(REMOVE, self.book.symbol, client_id, order_id)
+            if self.metrics != None:
+                self.journal_append.record(time.perf_counter_ns() - start)
+            self.check_checkpoint()
+
+        start = time.perf_counter_ns()
+        node = self.client_orders.get(client_id, {}).get(order_id)
+        if node == None:
+            return None, "ORDER NO LONGER OPEN"
+        order = self.book.remove(node.key)
+        self.index_discard(node.key)
+        if self.risk != None:
+            self.risk.on_remove(client_id, order)
+        if self.metrics != None:
+            self.book_remove.record(time.perf_counter_ns() - start)
+            self.counter[CANCELS] += 1
+        return order, None
+
+    def cancel_client(self, client_id):
+        # removes every order the client has in this book; returns [(order id, order)]
+        removed = []
+        for order_id in list(self.client_orders.get(client_id, {})):
+            order, _ = self.apply_remove(client_id, order_id)
+            removed.append((order_id, order))
+        return removed
+
+    def index_add(self, client_id, msg_id, key):
+        self.owners[key] = (client_id, msg_id)
+        if client_id not in self.client_orders:
+            self.client_orders[client_id] = {}
+        self.client_orders[client_id][msg_id] = self.book.open_orders[key]
+
+    def index_discard(self, key):
+        client_id, msg_id = self.owners.pop(key)
+        orders = self.client_orders.get(client_id)
+        if orders != None and msg_id in orders:
+            del orders[msg_id]
+            if len(orders) == 0:
+                del self.client_orders[client_id]
+
+    def book_snapshot(self, levels):
+        # returns the book version, the level count and the resting orders to render, or None in
+        # place of the orders when the output thread has already rendered this version
+        if levels != None and levels >= max(len(self.book.bids.keys), len(self.book.asks.keys)):
+            levels = None
+        if self.rendered_version != self.book.version:
+            self.rendered_version = self.book.version
+            self.rendered_levels = set()
+        if levels in self.rendered_levels:
+            return self.book.version, levels, None
+        self.rendered_levels.add(levels)
+        return self.book.version, levels, self.book.snapshot(levels)
+
+    def publish_depth(self):
+        if not self.book.track_depth:
+            return
+        update = self.book.take_depth_update()
+        if update != None:
+            seq, changes = update
+            self.outbox.put((DEPTH, self.book.symbol, seq, changes))
+            self.updates_since_snapshot += 1
+            if self.updates_since_snapshot >= DEPTH_SNAPSHOT_UPDATES:
+                self.publish_depth_snapshot()
+
+    def publish_depth_snapshot(self, subscriber_id=None):
+        # the full depth as of the last update, so a subscriber can start from it and apply
+        # every update with a higher seq. it goes to every subscriber unless one is named
+        bids, asks = self.book.depth()
+        self.outbox.put((DEPTH_SNAPSHOT, self.book.symbol, self.book.depth_seq, bids, asks, subscriber_id))
+        if subscriber_id == None:
+            self.updates_since_snapshot = 0
+
+    def check_checkpoint(self):
+        if self.journal.take_checkpoint():
+            self.outbox.put((CHECKPOINT,))
+
+class EngineThread(threading.Thread):
+    def __init__(self, book, outbox, journal=None, metrics=None, limits=None, owners=None):
+        super(EngineThread, self).__init__(daemon=True)
+        self.engine = MatchingEngine(book, outbox, journal, metrics, limits, owners)
+        self.inbox = queue.SimpleQueue()
+
+    def submit(self, command):
+        # commands carry the time they were queued so the engine can report queue wait
+        self.inbox.put((time.perf_counter_ns(), command))
+
+    def stop(self):
+        self.inbox.put(None)
+
+    def run(self):
+        engine = self.engine
+        while True:
+            item = self.inbox.get()
+            if item == None:
+                break
+            submitted, command = item
+            if engine.metrics != None:
+                engine.queue_wait.record(time.perf_counter_ns() - submitted)
+            engine.handle(command)
@@ -1,81 +1,223 @@
-import sys
+import os
+import time
+import queue
 import socket
+import asyncio
+import argparse
 import threading
 import datetime
 
 from book import *
+from engine import *
 from symbol import *
 from message import *
-
-MSG_SIZE = 512
+from publisher import *
+from audit_log import *
+from journal import *
+from metrics import *
+from sharding import *
+from order_table import *
+
+MSG_SIZE = 65536
 BYTE_CODE = "utf-8"
 
+# events buffered per stream subscriber before the slow consumer policy applies
+STREAM_BUFFER_LIMIT = 4096
+
+# an outbox item carrying a reply made on the input side
+REPLY = "REPLY"
+
 def encode(string):
     return (f"{string}\n\n").encode(BYTE_CODE)
 
-def encode_for_logging(string, unique_id=None):
-    date = datetime.datetime.now()
-    log_string = f"{str(date)}: "
-    if unique_id != None:
-        client_id, msg_id = unique_id
-        log_string += f"CLIENT {str(client_id)}, MESSAGE {str(msg_id)}: "
-    log_string += f"{string}\n"
-    return log_string
-
+class InputFramer:
+    # splits a client's byte stream into newline terminated text messages or, once the
+    # client has sent BINARY_MODE as its first line, into fixed size binary records
+    def __init__(self):
+        self.pending = b""
+        self.binary = False
+        self.negotiated = False
+
+    def feed(self, data):
+        pending = self.pending + data
+        frames = []
+        start = 0
+        while True:
+            if self.binary:
+                end = start + BINARY_MESSAGE_SIZE
+                if end > len(pending):
+                    break
+                frames.append(pending[start:end])
+                start = end
+            else:
+                end = pending.find(b"\n", start)
+                if end == -1:
+                    break
+                line = pending[start:end]
+                start = end + 1
+                if not self.negotiated:
+                    self.negotiated = True
+                    if line.strip().upper() == BINARY_MODE.encode(BYTE_CODE):
+                        self.binary = True
+                        frames.append(BINARY_MODE)
+                        continue
+                frames.append(line)
+        self.pending = pending[start:]
+        return frames
 
 WELCOME_MESSAGE = encode("WELCOME TO THE EXCHANGE!\nType 'help' for more info")
 
 HELP_MESSAGE = encode("Valid commands:\n" +
                "ADD-TICKER|SIDE|AMOUNT|PRICE to add an order\n" +
+               "    PRICE may be MARKET, and a fifth field of IOC, FOK or POST sets the order type\n" +
                "REMOVE-ID to remove an order\n" +
+               "BULK ADD-ORDER,ORDER,... to add several orders, each taking the next order ID\n" +
+               "BULK REMOVE-ID,ID,... to remove several orders\n" +
+               "CANCEL ALL to remove all of your orders (or CANCEL ALL-TICKER for one ticker)\n" +
                "BOOK-TICKER to see open orders on the book (use 'ALL' for all tickers)\n" +
-               "MY ORDERS to view your open orders\n\n" +
+               "    BOOK-TICKER|N shows only the best N price levels\n" +
+               "MY ORDERS to view your open orders\n" +
+               "METRICS to see latency percentiles and order counts\n" +
+               "SYMBOLS to list the tickers open for trading\n" +
+               "RELOAD SYMBOLS to reread the symbol file, if the exchange allows it;\n" +
+               "    retired tickers lose every client's open orders\n\n" +
+               f"send {BINARY_MODE} as your first line to switch to the binary protocol\n" +
                "press 'enter' to exit the exchange")
 
+BINARY_MESSAGE = encode(f"{BINARY_MODE} PROTOCOL ENABLED")
+
 OPEN_MESSAGE = "EXCHANGE OPENED"
 
 EXIT_MESSAGE = "EXCHANGE CLOSED"
 
 class ServeThread(threading.Thread):
-    def __init__(self, exchange, sock, cid):
+    def __init__(self, exchange, client, cid):
         super(ServeThread, self).__init__(daemon=True)
         self.exchange = exchange
-        self.socket = sock
+        self.client = client
         self.client_id = cid
 
     def run(self):
         msg_id = 0
-        with self.socket:
-            self.socket.send(WELCOME_MESSAGE)
-            while True:
-                raw_msg_stream = self.socket.recv(MSG_SIZE).decode(BYTE_CODE)
-                if raw_msg_stream == "\n":
-                    break
+        framer = InputFramer()
+
+        self.client.send(WELCOME_MESSAGE)
+        self.client.flush()
+        while msg_id != None:
+            try:
+                data = self.client.socket.recv(MSG_SIZE)
+            except OSError:
+                break
+            if data == b"":
+                break
+            msg_id = self.exchange.handle_data(framer, self.client_id, msg_id, data)
+            self.client.flush()
+
+        self.exchange.disconnect_client(self.client_id)
+        self.client.close()
+
+class BufferedClient:
+    # responses are gathered with send and written out together by flush, so a batch of
+    # input or a batch of engine results costs one write per client instead of one per message
+    def __init__(self):
+        self.buffer = []
+        self.lock = threading.Lock()
+        # replies are put in request order by the output thread, the only user of these
+        self.next_msg_id = 0
+        self.held = {}
+
+    def send(self, data):
+        self.lock.acquire()
+        self.buffer.append(data)
+        self.lock.release()
+
+    def send_in_order(self, msg_id, span, data):
+        # data answers the request given msg_id, which used span ids. with a span of 0 it only
+        # has to follow every request before msg_id. anything early is held until its turn
+        if msg_id > self.next_msg_id:
+            self.held.setdefault(msg_id, []).append((span, data))
+            return
+        self.send(data)
+        self.next_msg_id = max(self.next_msg_id, msg_id + span)
+        while len(self.held) > 0:
+            msg_id = min(self.held)
+            if msg_id > self.next_msg_id:
+                return
+            for span, data in self.held.pop(msg_id):
+                self.send(data)
+                self.next_msg_id = max(self.next_msg_id, msg_id + span)
+
+    def flush(self):
+        # writing under the lock keeps output ordered when several threads flush the same client
+        self.lock.acquire()
+        try:
+            if len(self.buffer) > 0:
+                data = b"".join(self.buffer)
+                self.buffer = []
+                self.write(data)
+        finally:
+            self.lock.release()
+
+class SocketClient(BufferedClient):
+    def __init__(self, sock):
+        super(SocketClient, self).__init__()
+        self.socket = sock
+        # replies are already batched by flush, so Nagle would only hold a reply back until
+        # the client acknowledges the last one, up to its delayed ACK timeout
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data):
+        try:
+            self.socket.sendall(data)
+        except OSError:
+            pass
+
+    def close(self):
+        self.flush()
+        self.socket.close()
+
+class AsyncClient(BufferedClient):
+    # output is flushed from the output thread too, so writes from other threads are handed
+    # to the event loop. on the loop's own thread they go straight to the transport, so the
+    # drain that follows a flush waits for them
+    def __init__(self, writer, loop):
+        super(AsyncClient, self).__init__()
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    def write(self, data):
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    def close(self):
+        self.flush()
+        if threading.get_ident() == self.loop_thread:
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+class OutputThread(threading.Thread):
+    def __init__(self, exchange):
+        super(OutputThread, self).__init__(daemon=True)
+        self.exchange = exchange
+
+    def run(self):
+        while True:
+            result = self.exchange.outbox.get()
+            # handle everything that is already waiting before flushing, so one burst of
+            # engine results reaches each client in a single write
+            while result != None:
+                self.exchange.handle_result(result)
                 try:
-                    extra = [raw_msg_stream[-1]]
-                    while extra[-1] != "\n":
-                        extra.append(self.socket.recv(1).decode(BYTE_CODE))
-
-                    raw_msgs = raw_msg_stream.strip().split("\n")
-                    for i in range(len(raw_msgs)):
-                        raw_msg = raw_msgs[i]
-                        if i == len(raw_msgs) - 1:
-                            raw_msg += "".join(extra[1:-1])
-                        msg = Message.deserialize(raw_msg.upper())
-                        self.exchange.handle_message(msg, self.client_id, msg_id)
-                        msg_id += 1
-                except Exception as e:
-                    error_msg = f"INVALID INPUT: {raw_msg}"
-                    self.exchange.write_to_log(encode_for_logging(error_msg, (self.client_id, msg_id)))
-                    if self.exchange.debug:
-                        raise e
-                    else:
-                        self.socket.send(encode(error_msg))
-
-        disconnect_msg = f"CLIENT {str(self.client_id)} HAS DISCONNECTED"
-        print(disconnect_msg)
-        self.exchange.write_to_log(encode_for_logging(disconnect_msg))
-        del self.exchange.clients[self.client_id]
+                    result = self.exchange.outbox.get_nowait()
+                except queue.Empty:
+                    break
+            self.exchange.flush_clients()
+            if result == None:
+                break
 
 class StreamThread(threading.Thread):
     def __init__(self, exchange):
@@ -92,207 +234,753 @@ class StreamThread(threading.Thread):
                 conn, addr = self.server.accept()
                 ip, port = addr
 
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 conn.send(encode(OPEN_MESSAGE))
-                self.exchange.stream_clients_lock.acquire()
-                self.exchange.stream_clients.append(conn)
-                self.exchange.stream_clients_lock.release()
+                subscriber_id = self.exchange.publisher.subscribe(conn)
+                # the new subscriber alone is sent every book's depth as a starting point
+                self.exchange.request_depth_snapshots(subscriber_id)
         except KeyboardInterrupt:
             self.server.close()
 
 class Exchange_Server:
-    def __init__(self, host, order_port, stream_port, log_file, debug):
+    def __init__(self, host, order_port, stream_port, log_file, debug,
+                 stream_buffer_limit=STREAM_BUFFER_LIMIT, slow_consumer_policy=DROP,
+                 log_durability=NONE, log_fsync_interval=1.0, journal_dir=None, cancel_on_disconnect=False, workers=0,
+                 symbol_file=None, risk_limits=None, allow_reload=False,
+                 journal_durability=NONE, journal_fsync_interval=1.0):
         self.host = host
         self.order_port = order_port
         self.stream_port = stream_port
-        self.stream_clients = []
-        self.stream_clients_lock = threading.Lock()
-
-        self.books = {symbol : Book(symbol) for symbol in ALL_SYMBOLS}
-        self.book_locks = {symbol : threading.Lock() for symbol in ALL_SYMBOLS}
+        # stream fan-out and log writes are timed per batch on their own threads, off the order path
+        self.metrics = Metrics()
+        self.publisher = Publisher(stream_buffer_limit, slow_consumer_policy, encode(EXIT_MESSAGE),
+                                   self.metrics.histogram(STREAM_PUBLISH))
 
         self.clients = {}
-        self.order_ids = {}
+        self.next_client_id = 0
+        self.orders = OrderTable()
+
+        self.outbox = queue.SimpleQueue()
+
+        # the symbols open for trading, in listing order. the dict is replaced, never changed,
+        # when the universe is reloaded, and books and engines are only made once a symbol
+        # is traded, so a large universe costs nothing until it is used
+        self.symbol_file = symbol_file
+        self.allow_reload = allow_reload
+        symbols = load_symbols(symbol_file) if symbol_file != None else ALL_SYMBOLS
+        self.symbols = {symbol : True for symbol in symbols}
+        self.books = {}
+        self.universe_lock = threading.Lock()
+        self.opened = False
+        self.workers = workers
+        self.risk_limits = risk_limits
+
+        # with a journal, books are rebuilt from the last snapshots plus the journal tail, and
+        # new clients are numbered after every client that still owns a recovered order
+        self.journal = None
+        self.snapshot_seqs = {}
+        if journal_dir != None and workers > 0:
+            raise ValueError("JOURNAL NOT SUPPORTED WITH WORKERS")
+        if journal_dir != None:
+            os.makedirs(journal_dir, exist_ok=True)
+            last_seq, max_client_id = recover(journal_dir, self.books, self.orders, track_depth=True)
+            self.next_client_id = max_client_id + 1
+            self.journal = Journal(journal_dir, last_seq, journal_durability, journal_fsync_interval)
+
+        # each book is owned by its engine thread; everything the engines produce
+        # goes through the outbox and is sent to clients by the output thread
+        # with workers the books live in the worker processes and the ones here stay empty
+        if workers > 0:
+            self.engines, self.runners = shard_engines(symbols, workers, self.outbox, risk_limits)
+            self.worker_processes = [runner for runner in self.runners if isinstance(runner, WorkerProcess)]
+        else:
+            self.engines = {}
+            self.runners = []
+            # every recovered book needs its engine, if only to keep snapshotting it
+            for symbol in list(self.books):
+                self.engine_for(symbol)
+        self.pending_replies = {}
+        # symbol -> (book version, {levels: rendered bytes}), only used by the output thread
+        self.book_renders = {}
+        self.touched_clients = set()
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.closing = False
 
         self.log_file = log_file
+        self.audit_log = AuditLog(log_file, log_durability, log_fsync_interval,
+                                  histogram=self.metrics.histogram(LOG_WRITE))
         self.debug = debug
 
+        self.client_send = self.metrics.histogram(CLIENT_SEND)
+
+    def handle_data(self, framer, client_id, msg_id, data):
+        # returns the id for the client's next message, or None once the client is leaving
+        for frame in framer.feed(data):
+            if frame == BINARY_MODE:
+                self.reply(client_id, msg_id, BINARY_MESSAGE, 0)
+            elif framer.binary:
+                msg_id = self.handle_input(frame, client_id, msg_id, binary=True)
+            else:
+                raw_msg = frame.decode(BYTE_CODE).strip()
+                # an empty line means the client is leaving
+                if raw_msg == "":
+                    return None
+                msg_id = self.handle_input(raw_msg, client_id, msg_id)
+        return msg_id
+
+    def handle_input(self, raw_msg, client_id, msg_id, binary=False):
+        # rejected input does not use up a msg id
+        try:
+            if binary:
+                msg = Message.unpack(raw_msg)
+            else:
+                msg = Message.deserialize(raw_msg.upper())
+            self.handle_message(msg, client_id, msg_id)
+            # each order in a bulk add gets its own id
+            return msg_id + (len(msg.data) if msg.type == BULK_ADD else 1)
+        except Exception as e:
+            raw_string = raw_msg.hex() if binary else raw_msg
+            error_msg = f"INVALID INPUT: {raw_string}"
+            self.write_to_log(error_msg, (client_id, msg_id))
+            if self.debug:
+                raise e
+            else:
+                # answered before whatever next takes this msg id
+                self.reply(client_id, msg_id, encode(error_msg), 0)
+            return msg_id
+
     def handle_message(self, msg, client_id, msg_id):
-        log_msg = f"MESSAGE RECEIVED: {str(msg)}"
-        self.write_to_log(encode_for_logging(log_msg, (client_id, msg_id)))
+        self.write_to_log("MESSAGE RECEIVED: {}", (client_id, msg_id), msg)
 
         if msg.type == HELP:
-            self.clients[client_id].send(HELP_MESSAGE)
+            self.reply(client_id, msg_id, HELP_MESSAGE)
 
         elif msg.type == MY_ORDERS:
-            self.send_open_orders(client_id)
+            # only engines holding one of the client's orders are asked, and each indexes its
+            # own book's orders by client, so this never scans a book
+            symbols = self.client_engines(client_id)
+            if len(symbols) == 0:
+                self.outbox.put((MY_ORDERS, client_id, msg_id, 0, 1, []))
+            for i in range(len(symbols)):
+                self.engines[symbols[i]].submit((MY_ORDERS, client_id, msg_id, i, len(symbols)))
+
+        elif msg.type == METRICS:
+            # engine metrics live in the worker processes, so each sends its own to be merged
+            if self.workers > 0:
+                for i in range(len(self.worker_processes)):
+                    self.worker_processes[i].request_metrics(client_id, msg_id, i, len(self.worker_processes))
+            else:
+                self.reply(client_id, msg_id, encode(self.metrics_report(self.metrics)))
 
         elif msg.type == ADD:
             order = msg.data
             symbol = order.symbol
-            
-            unique_id = (client_id, msg_id)
-            self.order_ids[unique_id] = symbol
-
-            stream_message = f"ORDER PLACED: {str(order)}"
-            self.stream_clients_lock.acquire()
-            for client in self.stream_clients:
-                client.send(encode(stream_message))
-            self.stream_clients_lock.release()
-            
-            self.book_locks[symbol].acquire()
-            filled_orders = self.books[symbol].add(order.copy(), unique_id)
-            self.book_locks[symbol].release()
-
-            self.stream_clients_lock.acquire()
-            for _, _, order in filled_orders:
-                stream_message = f"ORDER FILLED: {str(order)}"
-                for client in self.stream_clients:
-                    client.send(encode(stream_message))
-            self.stream_clients_lock.release()
-            
-            confirm_msg = f"{str(order)}\nHAS BEEN PLACED WITH ORDER ID {str(msg_id)}"
-            self.clients[client_id].send(encode(confirm_msg))
-            
-            log_msg = f"MESSAGE SENT: {confirm_msg}"
-            self.write_to_log(encode_for_logging(log_msg, (client_id, msg_id)))
-            
-            self.handle_filled_orders(filled_orders)
+            if symbol not in self.symbols:
+                self.reject(client_id, msg_id, f"SYMBOL NOT TRADING: {symbol.ticker}")
+                return
+
+            key = self.orders.allocate(client_id, msg_id, symbol)
+            self.engine_for(symbol).submit((ADD, client_id, msg_id, key, order))
 
         elif msg.type == REMOVE:
             order_id = msg.data
-            unique_id = (client_id, order_id)
-            try:
-                symbol = self.order_ids[unique_id]
-
-                order = self.books[symbol].get_open_order(unique_id)
-                
-                self.book_locks[symbol].acquire()
-                self.books[symbol].remove(unique_id)
-                self.book_locks[symbol].release()
-
-                stream_message = f"ORDER REMOVED: {str(order)}"
-                self.stream_clients_lock.acquire()
-                for client in self.stream_clients:
-                    client.send(encode(stream_message))
-                self.stream_clients_lock.release()
-                
-                confirm_msg = f"ORDER {str(order_id)} HAS BEEN REMOVED"
-                self.clients[client_id].send(encode(confirm_msg))
-                
-                log_msg = f"MESSAGE SENT: {confirm_msg}"
-                self.write_to_log(encode_for_logging(log_msg, (client_id, msg_id)))
-
-                del self.order_ids[unique_id]
-            except ValueError as e:
-                error_msg = f"CANNOT REMOVE ORDER: {str(e)}"
-                self.write_to_log(encode_for_logging(error_msg, (client_id, msg_id)))
-                if self.debug:
-                    raise e
+            symbol = self.orders.symbol(client_id, order_id)
+            if symbol == None:
+                self.reject(client_id, msg_id, f"CANNOT REMOVE ORDER {str(order_id)}: ORDER NO LONGER OPEN")
+                return
+
+            self.engines[symbol].submit((REMOVE, client_id, msg_id, order_id))
+
+        elif msg.type == BULK_ADD:
+            # one engine turn per symbol in the batch, answered with a single reply
+            for order in msg.data:
+                if order.symbol not in self.symbols:
+                    self.reject(client_id, msg_id, f"SYMBOL NOT TRADING: {order.symbol.ticker}", len(msg.data))
+                    return
+            by_symbol = {}
+            for i in range(len(msg.data)):
+                order = msg.data[i]
+                key = self.orders.allocate(client_id, msg_id + i, order.symbol)
+                by_symbol.setdefault(order.symbol, []).append((msg_id + i, key, order))
+            self.submit_parts(BULK_ADD, client_id, msg_id, by_symbol)
+
+        elif msg.type == BULK_REMOVE:
+            by_symbol = {}
+            unknown = []
+            for order_id in msg.data:
+                symbol = self.orders.symbol(client_id, order_id)
+                if symbol == None:
+                    unknown.append((order_id, None, "ORDER NOT FOUND"))
                 else:
-                    self.clients[client_id].send(encode(error_msg))
+                    by_symbol.setdefault(symbol, []).append(order_id)
+            # ids that never reached an engine are answered as one more part of the reply
+            self.submit_parts(BULK_REMOVE, client_id, msg_id, by_symbol, unknown)
+
+        elif msg.type == CANCEL_ALL:
+            symbols = self.client_engines(client_id)
+            if msg.data != ALL:
+                symbols = [symbol for symbol in symbols if symbol == msg.data]
+            if len(symbols) == 0:
+                self.outbox.put((CANCEL_ALL, client_id, msg_id, 0, 1, []))
+            for i in range(len(symbols)):
+                self.engines[symbols[i]].submit((CANCEL_ALL, client_id, msg_id, i, len(symbols)))
 
         elif msg.type == BOOK:
-            symbol = msg.data
-            to_print = [symbol] if symbol != ALL else self.books.keys()
-            for key in to_print:
-                self.book_locks[key].acquire()
-                self.clients[client_id].send(encode(str(self.books[key])))
-                self.book_locks[key].release()
+            target, levels = msg.data if isinstance(msg.data, tuple) else (msg.data, None)
+            to_print = [target] if target != ALL else list(self.symbols)
+            # every request is answered, since later replies to the client wait for it
+            if len(to_print) == 0:
+                self.reply(client_id, msg_id, encode("NO SYMBOLS TRADING"))
+            for i in range(len(to_print)):
+                engine = self.engines.get(to_print[i])
+                if engine != None:
+                    engine.submit((BOOK, client_id, msg_id, i, len(to_print), levels))
+                else:
+                    # nothing has traded, so the book is empty; with no version it is not cached
+                    self.outbox.put((BOOK, client_id, msg_id, i, len(to_print), to_print[i], None, None, ([], [])))
+
+        elif msg.type == SYMBOLS:
+            lines = [f"{symbol.ticker}: {symbol.actual}, TICK SIZE {str(symbol.tick_size)}" for symbol in self.symbols]
+            self.reply(client_id, msg_id, encode("\n".join(lines)))
+
+        elif msg.type == RELOAD_SYMBOLS:
+            # retiring a symbol cancels every client's orders in it, so clients may only
+            # reload when the exchange was started with --allow-reload
+            if not self.allow_reload:
+                self.reject(client_id, msg_id, "SYMBOL RELOAD NOT ALLOWED")
+            else:
+                self.reply(client_id, msg_id, encode(self.reload_symbols()))
 
         else:
-            error_msg = f"MESSAGE TYPE NOT SUPPORTED: {str(msg)}"
-            self.clients[client_id].send(encode(error_msg))
-
-            log_msg = f"MESSAGE SENT: {error_msg}"
-            self.write_to_log(encode_for_logging(log_msg, (client_id, msg_id)))
-
-
-    def handle_filled_orders(self, filled_orders):
-        for unique_id, placed_order, filled_order in filled_orders:
-            client_id, msg_id = unique_id
-            partially = "" if placed_order.amount == filled_order.amount else " PARTIALLY"
-            
-            log_msg = f"ORDER: {str(placed_order)}{partially} FILLED: {str(filled_order)}"
-            self.write_to_log(encode_for_logging(log_msg, unique_id))
-            
-            if client_id in self.clients:
-                send_string = encode(f"ORDER {str(msg_id)}:\n{str(placed_order)}\nHAS BEEN{partially} FILLED:\n{str(filled_order)}")
-                self.clients[client_id].send(send_string)
-            else:
-                missing_msg = f"CLIENT ID {str(client_id)} NOT FOUND"
-                self.write_to_log(encode_for_logging(missing_msg))
-
-    def send_open_orders(self, client_id):
-        sent = False
-        for symbol in self.books:
-            self.book_locks[symbol].acquire()
-            for order_id in self.books[symbol].open_orders:
-                cid, msg_id = order_id
-                if client_id == cid:
-                    order = self.books[symbol].open_orders[order_id].value
-                    order_string = f"ORDER {str(msg_id)}: {str(order)}"
-                    self.clients[client_id].send(encode(order_string))
-                    sent = True
-            self.book_locks[symbol].release()
-
-        if not sent:
-            self.clients[client_id].send(encode("NO OPEN ORDERS FOUND"))
-    
+            self.reject(client_id, msg_id, f"MESSAGE TYPE NOT SUPPORTED: {str(msg)}")
+
+
+    def handle_result(self, result):
+        typ = result[0]
+        if typ == ADD:
+            _, client_id, msg_id, key, order, filled_orders, dropped, rests, error = result
+            if error != None:
+                self.orders.release(key)
+                error_msg = f"ORDER REJECTED: {error}"
+                self.send_reply(client_id, msg_id, encode(error_msg))
+                self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), error_msg)
+                return
+            self.stream_placed(order, filled_orders, dropped)
+
+            confirm_msg = f"{str(order)}\nHAS BEEN PLACED WITH ORDER ID {str(msg_id)}"
+            if dropped > 0:
+                confirm_msg += f"\n{str(dropped)} UNFILLED AND CANCELLED"
+            self.send_reply(client_id, msg_id, encode(confirm_msg))
+
+            self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), confirm_msg)
+
+            self.handle_filled_orders(filled_orders, self.fill_owners(filled_orders))
+            self.release_finished(key, filled_orders, rests)
+
+        elif typ == REMOVE:
+            _, client_id, msg_id, order_id, order, error = result
+            if error != None:
+                error_msg = f"CANNOT REMOVE ORDER {str(order_id)}: {error}"
+                self.write_to_log(error_msg, (client_id, msg_id))
+                self.send_reply(client_id, msg_id, encode(error_msg))
+                return
+
+            self.stream(f"ORDER REMOVED: {str(order)}")
+
+            confirm_msg = f"ORDER {str(order_id)} HAS BEEN REMOVED"
+            self.send_reply(client_id, msg_id, encode(confirm_msg))
+
+            self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), confirm_msg)
+
+            self.orders.release_order(client_id, order_id)
+
+        elif typ == BOOK:
+            _, client_id, msg_id, position, total, symbol, version, levels, snapshot = result
+            rendered = self.rendered_book(symbol, version, levels, snapshot)
+            renders = self.collect_reply(client_id, msg_id, position, total, rendered)
+            if renders != None:
+                self.send_reply(client_id, msg_id, b"".join(renders))
+
+        elif typ == MY_ORDERS:
+            _, client_id, msg_id, position, total, lines = result
+            parts = self.collect_reply(client_id, msg_id, position, total, lines)
+            if parts != None:
+                lines = sorted([line for part in parts for line in part])
+                if len(lines) == 0:
+                    self.send_reply(client_id, msg_id, encode("NO OPEN ORDERS FOUND"))
+                else:
+                    self.send_reply(client_id, msg_id, b"".join([encode(line) for _, line in lines]))
+
+        elif typ == BULK_ADD:
+            # each part goes to the stream, and its fills to their owners, as soon as it is in;
+            # only the client's reply waits for every part
+            _, client_id, msg_id, position, total, results = result
+            lines = []
+            for order_id, key, order, filled_orders, dropped, rests, error in results:
+                if error != None:
+                    self.orders.release(key)
+                    lines.append((order_id, f"ORDER {str(order_id)} REJECTED: {error}"))
+                    continue
+                self.stream_placed(order, filled_orders, dropped)
+                line = f"{str(order)} HAS BEEN PLACED WITH ORDER ID {str(order_id)}"
+                if dropped > 0:
+                    line += f", {str(dropped)} UNFILLED AND CANCELLED"
+                lines.append((order_id, line))
+                self.handle_filled_orders(filled_orders, self.fill_owners(filled_orders))
+                self.release_finished(key, filled_orders, rests)
+            self.send_parts(client_id, msg_id, position, total, lines, None)
+
+        elif typ == BULK_REMOVE:
+            _, client_id, msg_id, position, total, results = result
+            lines = []
+            for order_id, order, error in results:
+                if error != None:
+                    lines.append((order_id, f"CANNOT REMOVE ORDER {str(order_id)}: {error}"))
+                else:
+                    self.stream(f"ORDER REMOVED: {str(order)}")
+                    lines.append((order_id, f"ORDER {str(order_id)} HAS BEEN REMOVED"))
+                    self.orders.release_order(client_id, order_id)
+            self.send_parts(client_id, msg_id, position, total, lines)
+
+        elif typ == CANCEL_ALL:
+            _, client_id, msg_id, position, total, removed = result
+            lines = []
+            for order_id, order in removed:
+                self.stream(f"ORDER REMOVED: {str(order)}")
+                lines.append((order_id, f"ORDER {str(order_id)}: {str(order)}"))
+                self.orders.release_order(client_id, order_id)
+            parts = self.collect_reply(client_id, msg_id, position, total, lines)
+            if parts != None:
+                lines = sorted([line for part in parts for line in part])
+                header = f"{str(len(lines))} ORDERS HAVE BEEN REMOVED"
+                confirm_msg = "\n".join([header] + [line for _, line in lines])
+                self.send_reply(client_id, msg_id, encode(confirm_msg))
+                self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), confirm_msg)
+
+        elif typ == CANCEL_CLIENT:
+            _, client_id, removed, reason = result
+            for order_id, order in removed:
+                self.stream(f"ORDER REMOVED: {str(order)}")
+                cancel_msg = f"ORDER {str(order_id)} CANCELLED {reason}: {str(order)}"
+                self.write_to_log(cancel_msg, (client_id, order_id))
+                self.send_notice(client_id, order_id, encode(cancel_msg))
+                self.orders.release_order(client_id, order_id)
+
+        elif typ == DEPTH:
+            _, symbol, seq, changes = result
+            lines = [f"DEPTH UPDATE: {symbol.ticker} {str(seq)}"]
+            for side, price, volume in changes:
+                lines.append(f"{side} {symbol.format_price(price)} {str(volume)}")
+            self.stream("\n".join(lines))
+
+        elif typ == DEPTH_SNAPSHOT:
+            _, symbol, seq, bids, asks, subscriber_id = result
+            lines = [f"DEPTH SNAPSHOT: {symbol.ticker} {str(seq)}"]
+            for side, levels in ((BUY, bids), (SELL, asks)):
+                for price, volume in levels:
+                    lines.append(f"{side} {symbol.format_price(price)} {str(volume)}")
+            self.stream("\n".join(lines), subscriber_id)
+
+        elif typ == METRICS:
+            _, client_id, msg_id, position, total, metrics = result
+            parts = self.collect_reply(client_id, msg_id, position, total, metrics)
+            if parts != None:
+                self.send_reply(client_id, msg_id, encode(self.metrics_report(self.metrics.merged(parts))))
+
+        elif typ == REPLY:
+            _, client_id, msg_id, span, data = result
+            self.send_reply(client_id, msg_id, data, span)
+
+        elif typ == CHECKPOINT:
+            self.checkpoint()
+
+        elif typ == SNAPSHOT:
+            # journal segments are only dropped once every book has a snapshot past them
+            _, symbol, seq = result
+            self.snapshot_seqs[symbol] = seq
+            if len(self.snapshot_seqs) == len(self.engines):
+                self.journal.truncate_before(min(self.snapshot_seqs.values()))
+
+    def reject(self, client_id, msg_id, error_msg, span=1):
+        self.reply(client_id, msg_id, encode(error_msg), span)
+        self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), error_msg)
+
+    def reply(self, client_id, msg_id, data, span=1):
+        # replies made on the input side go through the outbox as well, so they reach the
+        # client behind the answers to its earlier requests
+        self.outbox.put((REPLY, client_id, msg_id, span, data))
+
+    def engine_for(self, symbol):
+        # the engine, and book, for a symbol are made the first time it is needed
+        engine = self.engines.get(symbol)
+        if engine != None:
+            return engine
+        self.universe_lock.acquire()
+        try:
+            if symbol not in self.engines:
+                if symbol not in self.books:
+                    self.books[symbol] = Book(symbol, track_depth=True)
+                book = self.books[symbol]
+                owners = {key : self.orders.owner(key) for key in book.open_orders}
+                engine = EngineThread(book, self.outbox, self.journal, self.metrics, self.risk_limits, owners)
+                # a recovered book whose symbol has since left the file stays retired
+                if symbol not in self.symbols:
+                    engine.submit((TRADING, False))
+                self.runners.append(engine)
+                if self.opened:
+                    engine.start()
+                self.engines[symbol] = engine
+            return self.engines[symbol]
+        finally:
+            self.universe_lock.release()
+
+    def reload_symbols(self):
+        # symbols new to the file open for trading; symbols gone from it are retired, which
+        # cancels their resting orders and turns away new ones until they come back
+        if self.symbol_file == None:
+            return "NO SYMBOL FILE CONFIGURED"
+        if self.workers > 0:
+            return "SYMBOLS CANNOT BE RELOADED WITH WORKERS"
+
+        self.universe_lock.acquire()
+        try:
+            try:
+                symbols = {symbol : True for symbol in load_symbols(self.symbol_file)}
+            except (OSError, ValueError, KeyError) as e:
+                return f"CANNOT RELOAD SYMBOLS: {str(e)}"
+            added = [symbol for symbol in symbols if symbol not in self.symbols]
+            retired = [symbol for symbol in self.symbols if symbol not in symbols]
+            self.symbols = symbols
+            for symbol in retired:
+                if symbol in self.engines:
+                    self.engines[symbol].submit((TRADING, False))
+            for symbol in added:
+                if symbol in self.engines:
+                    self.engines[symbol].submit((TRADING, True))
+        finally:
+            self.universe_lock.release()
+
+        added_string = ", ".join([symbol.ticker for symbol in added]) or "NONE"
+        retired_string = ", ".join([symbol.ticker for symbol in retired]) or "NONE"
+        reload_msg = f"SYMBOLS ADDED: {added_string}\nSYMBOLS RETIRED: {retired_string}"
+        self.write_to_log(reload_msg)
+        return reload_msg
+
+    def stream_placed(self, order, filled_orders, dropped):
+        self.stream(f"ORDER PLACED: {str(order)}")
+        for fill in filled_orders:
+            for _, side, _, _ in fill.parties():
+                self.stream(f"ORDER FILLED: {order_string(fill.symbol, side, fill.amount, fill.price)}")
+        if dropped > 0:
+            # what an IOC, FOK, market or post only order did not fill never rests
+            self.stream(f"ORDER CANCELLED: {order_string(order.symbol, order.side, dropped, order.price)}")
+
+    def rendered_book(self, symbol, version, levels, snapshot):
+        # BOOK replies are rendered here rather than on the engine, and kept per symbol until its
+        # book version moves on. the engine sends no snapshot once this holds version and levels
+        cached = self.book_renders.get(symbol)
+        if snapshot == None:
+            return cached[1][levels]
+        rendered = encode(render_book(symbol, *snapshot))
+        if version != None:
+            if cached == None or cached[0] != version:
+                cached = (version, {})
+                self.book_renders[symbol] = cached
+            cached[1][levels] = rendered
+        return rendered
+
+    def collect_reply(self, client_id, msg_id, position, total, part):
+        # requests answered by several engines are sent once every part is in, in order;
+        # returns the parts when complete and None while some are still missing
+        unique_id = (client_id, msg_id)
+        if unique_id not in self.pending_replies:
+            self.pending_replies[unique_id] = [None] * total
+        parts = self.pending_replies[unique_id]
+        parts[position] = part
+        if None in parts:
+            return None
+        del self.pending_replies[unique_id]
+        return parts
+
+    def send_parts(self, client_id, msg_id, position, total, lines, span=1):
+        # a bulk reply is one line per order id, sent once every part is in. a span of None
+        # means the request used one msg id per line, as a bulk add does
+        parts = self.collect_reply(client_id, msg_id, position, total, lines)
+        if parts == None:
+            return
+        lines = sorted([line for part in parts for line in part])
+        confirm_msg = "\n".join([line for _, line in lines])
+        self.send_reply(client_id, msg_id, encode(confirm_msg), len(lines) if span == None else span)
+        self.write_to_log("MESSAGE SENT: {}", (client_id, msg_id), confirm_msg)
+
+    def submit_parts(self, typ, client_id, msg_id, by_symbol, extra=None):
+        # sends each symbol's share of a multi-symbol request to its engine. extra, when
+        # there is any, is results the server already knows and becomes the last part
+        symbols = list(by_symbol.keys())
+        total = len(symbols) + (1 if extra else 0)
+        for i in range(len(symbols)):
+            self.engine_for(symbols[i]).submit((typ, client_id, msg_id, i, total, by_symbol[symbols[i]]))
+        if extra:
+            self.outbox.put((typ, client_id, msg_id, len(symbols), total, extra))
+
+    def client_engines(self, client_id):
+        # the symbols whose engines may hold an order of the client's. ids are allocated before
+        # an order reaches its engine and released only once it has left the book, so no live
+        # order is missed
+        return sorted([symbol for symbol in self.orders.client_symbols(client_id) if symbol in self.engines])
+
+    def request_depth_snapshots(self, subscriber_id):
+        for symbol in list(self.engines):
+            self.engines[symbol].submit((DEPTH_SNAPSHOT, subscriber_id))
+
+    def checkpoint(self):
+        for symbol in list(self.engines):
+            self.engines[symbol].submit((SNAPSHOT,))
+
+    def stream(self, stream_message, subscriber_id=None):
+        # to every subscriber, or to one when its id is given
+        if subscriber_id == None:
+            self.publisher.publish(encode(stream_message))
+        else:
+            self.publisher.send(subscriber_id, encode(stream_message))
+
+    def send_reply(self, client_id, msg_id, data, span=1):
+        client = self.clients.get(client_id)
+        if client != None:
+            client.send_in_order(msg_id, span, data)
+            self.touched_clients.add(client)
+
+    def send_notice(self, client_id, order_id, data):
+        # news about an order, such as a fill, never goes out before the reply that placed it
+        self.send_reply(client_id, order_id + 1, data, 0)
+
+    def flush_clients(self):
+        for client in self.touched_clients:
+            start = time.perf_counter_ns()
+            client.flush()
+            self.client_send.record(time.perf_counter_ns() - start)
+        self.touched_clients.clear()
+
+    def fill_owners(self, filled_orders):
+        # the (client id, msg id) of the buyer and seller in each fill. keys are looked up while
+        # they are certain to be live, since a released key can be handed to another order
+        return [[self.orders.owner(party[0]) for party in fill.parties()] for fill in filled_orders]
+
+    def release_finished(self, key, filled_orders, rests):
+        # frees the keys of the makers an order used up, and its own unless it rests
+        for fill in filled_orders:
+            if fill.maker_remaining == 0:
+                self.orders.release(fill.maker_id)
+        if not rests:
+            self.orders.release(key)
+
+    def handle_filled_orders(self, filled_orders, owners):
+        for i in range(len(filled_orders)):
+            fill = filled_orders[i]
+            for (_, side, price, remaining), unique_id in zip(fill.parties(), owners[i]):
+                client_id, msg_id = unique_id
+                partially = "" if remaining == 0 else " PARTIALLY"
+                placed_string = order_string(fill.symbol, side, remaining + fill.amount, price)
+                filled_string = order_string(fill.symbol, side, fill.amount, fill.price)
+
+                self.write_to_log("ORDER: {}{} FILLED: {}", unique_id, placed_string, partially, filled_string)
+
+                if client_id in self.clients:
+                    send_string = encode(f"ORDER {str(msg_id)}:\n{placed_string}\nHAS BEEN{partially} FILLED:\n{filled_string}")
+                    self.send_notice(client_id, msg_id, send_string)
+                else:
+                    missing_msg = f"CLIENT ID {str(client_id)} NOT FOUND"
+                    self.write_to_log(missing_msg)
+
     def close_order_clients(self):
-        for client_id in self.clients:
+        for client_id in list(self.clients):
             self.clients[client_id].send(encode(EXIT_MESSAGE))
             self.clients[client_id].close()
 
     def close_stream_clients(self):
-        for stream_client in self.stream_clients:
-            stream_client.send(encode(EXIT_MESSAGE))
-            stream_client.close()
-
-    def write_to_log(self, string):
-        self.log_file.write(string)
-        self.log_file.flush()
-
-    def serve(self):
-        self.write_to_log(encode_for_logging(OPEN_MESSAGE))
+        self.publisher.stop()
+        self.publisher.join(1)
+
+    def write_to_log(self, string, unique_id=None, *args):
+        # args are formatted into string by the log thread, off the order path
+        self.audit_log.write(string, unique_id, args)
+
+    def metrics_report(self, metrics):
+        return (f"{metrics.report()}\n\n" +
+                f"STREAM EVENTS DROPPED: {str(self.publisher.dropped)}\n" +
+                f"STREAM SUBSCRIBERS DISCONNECTED: {str(self.publisher.disconnected)}\n" +
+                f"ORDER IDS LIVE: {str(len(self.orders))}\n" +
+                f"ORDER ID SLOTS: {str(len(self.orders.clients))}")
+
+    def open(self):
+        self.audit_log.start()
+        self.write_to_log(OPEN_MESSAGE)
         print(f"\n{OPEN_MESSAGE}\n")
 
+        self.publisher.start()
         stream_thread = StreamThread(self)
         stream_thread.start()
-        
+
+        output_thread = OutputThread(self)
+        output_thread.start()
+        self.universe_lock.acquire()
+        self.opened = True
+        for runner in self.runners:
+            runner.start()
+        self.universe_lock.release()
+        if self.journal != None:
+            self.checkpoint()
+
+    def close(self):
+        self.closing = True
+        self.close_order_clients()
+        self.close_stream_clients()
+        self.write_to_log(EXIT_MESSAGE)
+        self.audit_log.stop()
+        if self.journal != None:
+            self.journal.close()
+        print(f"\nEXIT_MESSAGE\n")
+
+    def disconnect_client(self, client_id):
+        disconnect_msg = f"CLIENT {str(client_id)} HAS DISCONNECTED"
+        print(disconnect_msg)
+        self.write_to_log(disconnect_msg)
+        del self.clients[client_id]
+
+        # clients dropped by a shutdown keep their orders, as the journal does across a restart
+        if self.cancel_on_disconnect and not self.closing:
+            # queued behind everything the client sent, so no order of theirs is missed
+            for symbol in self.client_engines(client_id):
+                self.engines[symbol].submit((CANCEL_CLIENT, client_id))
+
+    def connect_client(self, client, ip, port):
+        client_id = self.next_client_id
+        self.next_client_id += 1
+
+        connect_msg = f"CLIENT {str(client_id)} CONNECTED AT {ip}: {str(port)}"
+        print(connect_msg)
+
+        self.write_to_log(connect_msg)
+
+        self.clients[client_id] = client
+        return client_id
+
+    def serve(self):
+        self.open()
+
         server = socket.socket()
         server.bind((self.host, self.order_port))
         server.listen()
 
-        client_id = 0
-
         try:
             while True:
                 conn, addr = server.accept()
                 ip, port = addr
-                
-                connect_msg = f"CLIENT {str(client_id)} CONNECTED AT {ip}: {str(port)}"
-                print(connect_msg)
-
-                self.write_to_log(encode_for_logging(connect_msg))
 
-                self.clients[client_id] = conn
-                new_thread = ServeThread(self, conn, client_id)
+                client = SocketClient(conn)
+                client_id = self.connect_client(client, ip, port)
+                new_thread = ServeThread(self, client, client_id)
                 new_thread.start()
-
-                client_id += 1
         except KeyboardInterrupt:
             server.close()
-            self.close_order_clients()
-            self.close_stream_clients()
-            self.write_to_log(encode_for_logging(EXIT_MESSAGE))
-            print(f"\nEXIT_MESSAGE\n")
+            self.close()
+
+    async def serve_async(self):
+        self.open()
+
+        server = await asyncio.start_server(self.serve_async_client, self.host, self.order_port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # clients are closed while the loop still runs, since their writes go through it
+            self.close()
+
+    async def serve_async_client(self, reader, writer):
+        ip, port = writer.get_extra_info("peername")[:2]
+        client = AsyncClient(writer, asyncio.get_running_loop())
+        client_id = self.connect_client(client, ip, port)
+
+        msg_id = 0
+        framer = InputFramer()
+
+        try:
+            client.send(WELCOME_MESSAGE)
+            client.flush()
+            while msg_id != None:
+                data = await reader.read(MSG_SIZE)
+                if data == b"":
+                    break
+                msg_id = self.handle_data(framer, client_id, msg_id, data)
+                client.flush()
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # a reset, or the loop shutting down, ends the connection like any other close
+            pass
+        finally:
+            self.disconnect_client(client_id)
+            client.close()
 
 if __name__ == "__main__":
-    debug = False
-    order_port = int(sys.argv[1])
-    stream_port = int(sys.argv[2])
-    if len(sys.argv) > 3:
-        debug = bool(sys.argv[3])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("order_port", type=int)
+    parser.add_argument("stream_port", type=int)
+    parser.add_argument("debug", nargs="?", default="")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve order clients from an asyncio event loop instead of a thread per client")
+    parser.add_argument("--stream-buffer", type=int, default=STREAM_BUFFER_LIMIT,
+                        help="events buffered per stream subscriber before it counts as slow")
+    parser.add_argument("--slow-consumer", choices=sorted(SLOW_CONSUMER_POLICIES), default=DROP, type=str.upper,
+                        help="drop new events for, or disconnect, a subscriber whose buffer is full")
+    parser.add_argument("--log-durability", choices=sorted(DURABILITY_MODES), default=NONE, type=str.upper,
+                        help="fsync the audit log never, every --log-fsync-ms, or before every record returns")
+    parser.add_argument("--log-fsync-ms", type=int, default=1000)
+    parser.add_argument("--journal", default=None,
+                        help="directory for the write-ahead journal and book snapshots; books are recovered from it on startup")
+    parser.add_argument("--journal-durability", choices=sorted(DURABILITY_MODES), default=NONE, type=str.upper,
+                        help="fsync the journal never (the default: records survive a crash of the exchange but not "
+                             "of the machine), every --journal-fsync-ms, or before every add or remove is applied")
+    parser.add_argument("--journal-fsync-ms", type=int, default=1000)
+    parser.add_argument("--cancel-on-disconnect", action="store_true",
+                        help="cancel every open order a client has once it disconnects")
+    parser.add_argument("--symbols", default=None,
+                        help="JSON file listing the symbols to trade")
+    parser.add_argument("--allow-reload", action="store_true",
+                        help="let any order client send RELOAD SYMBOLS to reread --symbols, cancelling every order in retired symbols")
+    parser.add_argument("--max-order-amount", type=int, default=None,
+                        help="reject orders for more than this amount")
+    parser.add_argument("--max-notional", default=None,
+                        help="reject orders worth more than this, priced at their limit or the last trade")
+    parser.add_argument("--max-open-orders", type=int, default=None,
+                        help="open orders a client may have in one symbol")
+    parser.add_argument("--max-open-amount", type=int, default=None,
+                        help="amount a client may have resting on one side of one symbol")
+    parser.add_argument("--max-position", type=int, default=None,
+                        help="position a client may reach in one symbol if all its open orders fill")
+    parser.add_argument("--price-band", default=None,
+                        help="reject limit prices further than this fraction from the last trade or best price")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="experimental: run the books in this many worker processes instead of engine threads. "
+                             "only measured on one core so far, where it is slower than the default")
+    args = parser.parse_args()
+
+    risk_limits = None
+    if any([limit != None for limit in (args.max_order_amount, args.max_notional, args.max_open_orders,
+                                        args.max_open_amount, args.max_position, args.price_band)]):
+        risk_limits = RiskLimits(args.max_order_amount, args.max_notional, args.max_open_orders,
+                                 args.max_open_amount, args.max_position, args.price_band)
+
+    debug = bool(args.debug)
     log_file = open(f"logs/log_{str(datetime.datetime.now().date())}.txt", "a")
-    server = Exchange_Server('localhost', order_port, stream_port, log_file, debug)
-    server.serve()
+    server = Exchange_Server('localhost', args.order_port, args.stream_port, log_file, debug,
+                             args.stream_buffer, args.slow_consumer,
+                             args.log_durability, args.log_fsync_ms / 1000, args.journal, args.cancel_on_disconnect,
+                             args.workers, args.symbols, risk_limits, args.allow_reload,
+                             args.journal_durability, args.journal_fsync_ms / 1000)
+    if args.use_async:
+        try:
+            asyncio.run(server.serve_async())
+        except KeyboardInterrupt:
+            pass
+    else:
+        server.serve()
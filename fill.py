@@ -0,0 +1,38 @@
+from order import *
+
+class Fill:
+    # one crossing of a taker against a resting maker; the amounts left on
+    # each order afterwards are carried so callers never need order copies
+    __slots__ = ("symbol", "taker_side", "maker_id", "taker_id", "maker_price", "taker_price",
+                 "price", "amount", "maker_remaining", "taker_remaining")
+
+    def __init__(self, symbol, taker_side, maker_id, taker_id, maker_price, taker_price,
+                 price, amount, maker_remaining, taker_remaining):
+        self.symbol = symbol
+        self.taker_side = taker_side
+        self.maker_id = maker_id
+        self.taker_id = taker_id
+        self.maker_price = maker_price
+        self.taker_price = taker_price
+        self.price = price
+        self.amount = amount
+        self.maker_remaining = maker_remaining
+        self.taker_remaining = taker_remaining
+
+    def maker_side(self):
+        return SELL if self.taker_side == BUY else BUY
+
+    def parties(self):
+        # (order id, side, order price, amount left) for the buyer, then the seller
+        maker = (self.maker_id, self.maker_side(), self.maker_price, self.maker_remaining)
+        taker = (self.taker_id, self.taker_side, self.taker_price, self.taker_remaining)
+        if self.taker_side == BUY:
+            return (taker, maker)
+        return (maker, taker)
+
+    def __str__(self):
+        price = self.symbol.format_price(self.price)
+        return f"{str(self.symbol)} {str(self.amount)} @ {price} (MAKER {str(self.maker_id)}, TAKER {str(self.taker_id)})"
+
+    def __repr__(self):
+        return str(self)
@@ -0,0 +1,266 @@
+import os
+import time
+import struct
+import threading
+
+from book import *
+from message import *
+from audit_log import NONE, INTERVAL, RECORD, DURABILITY_MODES
+
+SNAPSHOT = "SNAPSHOT"
+CHECKPOINT = "CHECKPOINT"
+
+# seq, msg type, ticker, client id, order id, side and order type, price in ticks, amount.
+# for a REMOVE the order id is the id of the order being removed
+JOURNAL_RECORD = struct.Struct("<QB8sIIBqI")
+# ticker, last journal seq reflected in the snapshot, number of resting orders
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+# client id, order id, side, price in ticks, amount
+SNAPSHOT_ORDER = struct.Struct("<IIBqI")
+
+SEGMENT_RECORDS = 1000000
+CHECKPOINT_RECORDS = 100000
+
+JOURNAL_PREFIX = "journal_"
+SNAPSHOT_SUFFIX = ".snapshot"
+
+def segment_paths(directory):
+    names = sorted([name for name in os.listdir(directory) if name.startswith(JOURNAL_PREFIX)])
+    return [os.path.join(directory, name) for name in names]
+
+def segment_first_seq(path):
+    return int(os.path.basename(path)[len(JOURNAL_PREFIX):])
+
+def snapshot_path(directory, ticker):
+    return os.path.join(directory, f"{ticker}{SNAPSHOT_SUFFIX}")
+
+def read_segment(path):
+    with open(path, "rb") as segment:
+        data = segment.read()
+    # a record cut short by a crash is ignored
+    end = len(data) - len(data) % JOURNAL_RECORD.size
+    return JOURNAL_RECORD.iter_unpack(data[:end])
+
+def read_journal(directory):
+    for path in segment_paths(directory):
+        for record in read_segment(path):
+            yield record
+
+def write_snapshot(directory, book, seq, owners):
+    # owners maps each resting order's key to its (client id, msg id)
+    ticker = book.symbol.ticker.encode("utf-8")
+    chunks = [SNAPSHOT_HEADER.pack(ticker, seq, len(book.open_orders))]
+    # bids then asks, each in priority order, so reloading them in order restores time priority
+    for side in (book.bids, book.asks):
+        for node in side:
+            client_id, msg_id = owners[node.key]
+            order = node.value
+            chunks.append(SNAPSHOT_ORDER.pack(client_id, msg_id, SIDE_TO_CODE[order.side], order.price, order.amount))
+
+    path = snapshot_path(directory, book.symbol.ticker)
+    with open(path + ".tmp", "wb") as snapshot:
+        snapshot.write(b"".join(chunks))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(path + ".tmp", path)
+
+def read_snapshot(directory, book, orders):
+    # loads the snapshot for book, if there is one, and returns the seq it reflects. every
+    # order is given a key from the OrderTable orders
+    path = snapshot_path(directory, book.symbol.ticker)
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, "rb") as snapshot:
+        data = snapshot.read()
+    _, seq, count = SNAPSHOT_HEADER.unpack_from(data)
+    for client_id, msg_id, side, price, amount in SNAPSHOT_ORDER.iter_unpack(data[SNAPSHOT_HEADER.size:]):
+        key = orders.allocate(client_id, msg_id, book.symbol)
+        book.rest(Order(book.symbol, CODE_TO_SIDE[side], price, amount), key)
+    assert len(book.open_orders) == count
+    return seq
+
+def recovered_book(books, ticker, track_depth):
+    symbol = Symbol.from_ticker(ticker)
+    if symbol not in books:
+        books[symbol] = Book(symbol, track_depth)
+    return books[symbol]
+
+def recover(directory, books, orders, track_depth=False):
+    # rebuilds books from their snapshots plus the journal records written after them. a Book
+    # is added to books for every registered ticker that has either; the rest are skipped.
+    # orders is an OrderTable left holding a key for every order still resting.
+    # returns the last journal seq and the highest client id seen
+    snapshot_seqs = {}
+    for name in sorted(os.listdir(directory)):
+        ticker = name[:-len(SNAPSHOT_SUFFIX)]
+        if name.endswith(SNAPSHOT_SUFFIX) and ticker in TICKER_TO_SYMBOL:
+            snapshot_seqs[ticker] = read_snapshot(directory, recovered_book(books, ticker, track_depth), orders)
+
+    last_seq = max(snapshot_seqs.values()) if len(snapshot_seqs) > 0 else 0
+    max_client_id = orders.max_client_id()
+
+    for seq, code, ticker, client_id, order_id, side, price, amount in read_journal(directory):
+        last_seq = max(last_seq, seq)
+        max_client_id = max(max_client_id, client_id)
+        ticker = ticker.rstrip(b"\0").decode("utf-8")
+        if ticker not in TICKER_TO_SYMBOL or seq <= snapshot_seqs.get(ticker, 0):
+            continue
+
+        book = recovered_book(books, ticker, track_depth)
+        if CODE_TO_TYPE[code] == ADD:
+            key = orders.allocate(client_id, order_id, book.symbol)
+            for fill in book.add(decode_order(book.symbol, side, price, amount), key):
+                if fill.maker_remaining == 0:
+                    orders.release(fill.maker_id)
+            if key not in book.open_orders:
+                orders.release(key)
+        else:
+            key = orders.find(client_id, order_id)
+            if key != None and key in book.open_orders:
+                book.remove(key)
+                orders.release(key)
+
+    return last_seq, max_client_id
+
+class Journal:
+    # append-only log of every command an engine is about to apply. engines for
+    # different symbols share one journal; the lock only orders their appends.
+    # durability works as for the audit log: NONE hands each record to the OS and never
+    # fsyncs, INTERVAL fsyncs from an append at least fsync_interval after the last sync,
+    # RECORD returns from append only once the record is fsynced. syncs are group commits,
+    # made outside the lock by one waiting engine for every record written so far.
+    # close() always fsyncs
+    def __init__(self, directory, last_seq, durability=NONE, fsync_interval=1.0,
+                 segment_records=SEGMENT_RECORDS, checkpoint_records=CHECKPOINT_RECORDS):
+        assert durability in DURABILITY_MODES
+        self.directory = directory
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self.segment_records = segment_records
+        self.checkpoint_records = checkpoint_records
+        self.lock = threading.Lock()
+
+        self.seq = last_seq
+        self.segment = None
+        self.segment_length = 0
+        self.since_checkpoint = 0
+
+        self.synced = threading.Condition()
+        self.synced_seq = last_seq
+        self.syncing = False
+        self.last_sync = time.monotonic()
+
+    def append(self, typ, symbol, client_id, order_id, side=None, price=0, amount=0, order_type=LIMIT):
+        side_code = encode_side(side, order_type) if side != None else 0
+        price = price if price != None else 0
+        ticker = symbol.ticker.encode("utf-8")
+
+        self.lock.acquire()
+        try:
+            self.seq += 1
+            seq = self.seq
+            if self.segment == None or self.segment_length >= self.segment_records:
+                self.rotate()
+            self.segment.write(JOURNAL_RECORD.pack(seq, TYPE_TO_CODE[typ], ticker,
+                                                   client_id, order_id, side_code, price, amount))
+            # with RECORD the sync flushes whatever is buffered by then
+            if self.durability != RECORD:
+                self.segment.flush()
+            self.segment_length += 1
+            self.since_checkpoint += 1
+        finally:
+            self.lock.release()
+
+        if self.durability == RECORD or (self.durability == INTERVAL and self.sync_due()):
+            self.sync(seq)
+        return seq
+
+    def sync_due(self):
+        return time.monotonic() - self.last_sync >= self.fsync_interval
+
+    def sync(self, seq):
+        # waits until every record up to seq is fsynced, syncing itself if no one else is
+        self.synced.acquire()
+        try:
+            while self.synced_seq < seq:
+                if self.syncing:
+                    self.synced.wait()
+                    continue
+                self.syncing = True
+                self.synced.release()
+                try:
+                    synced_seq = self.fsync_segment()
+                finally:
+                    self.synced.acquire()
+                    self.syncing = False
+                    self.synced.notify_all()
+                self.synced_seq = max(self.synced_seq, synced_seq)
+                self.last_sync = time.monotonic()
+        finally:
+            self.synced.release()
+
+    def fsync_segment(self):
+        # flushes under the lock but fsyncs a duplicate of the segment's descriptor outside it,
+        # so appends carry on and a rotation cannot close the file under us. returns the last
+        # seq the sync covers
+        self.lock.acquire()
+        try:
+            seq = self.seq
+            if self.segment == None:
+                return seq
+            self.segment.flush()
+            fd = os.dup(self.segment.fileno())
+        finally:
+            self.lock.release()
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return seq
+
+    def rotate(self):
+        if self.segment != None:
+            # later syncs only reach the new segment
+            self.segment.flush()
+            if self.durability != NONE:
+                os.fsync(self.segment.fileno())
+            self.segment.close()
+        name = f"{JOURNAL_PREFIX}{self.seq:020d}"
+        self.segment = open(os.path.join(self.directory, name), "ab")
+        self.segment_length = 0
+
+    def current_seq(self):
+        self.lock.acquire()
+        seq = self.seq
+        self.lock.release()
+        return seq
+
+    def take_checkpoint(self):
+        # true for exactly one caller once checkpoint_records have been appended
+        self.lock.acquire()
+        due = self.since_checkpoint >= self.checkpoint_records
+        if due:
+            self.since_checkpoint = 0
+        self.lock.release()
+        return due
+
+    def truncate_before(self, seq):
+        # drops whole segments whose records are all covered by snapshots at or after seq
+        self.lock.acquire()
+        try:
+            paths = segment_paths(self.directory)
+            for i in range(len(paths) - 1):
+                if segment_first_seq(paths[i + 1]) <= seq + 1:
+                    os.remove(paths[i])
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        if self.segment != None:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+            self.segment = None
+        self.lock.release()
@@ -1,4 +1,6 @@
 class LinkedListNode:
+    __slots__ = ("key", "value", "prev", "next")
+
     def __init__(self, key, value, prev=None, nxt=None):
         self.key = key
         self.value = value
@@ -9,6 +11,8 @@ class LinkedListNode:
         return "LinkedListNode(key=" + str(self.key) + ", value=" + str(self.value)
 
 class LinkedList:
+    __slots__ = ("head", "tail", "length")
+
     def __init__(self):
         self.head = None
         self.tail = None
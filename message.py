@@ -1,3 +1,5 @@
+import struct
+
 from order import *
 from symbol import *
 
@@ -5,11 +7,55 @@ ADD = "ADD"
 REMOVE = "REMOVE"
 BOOK = "BOOK"
 ALL = "ALL"
+# BOOK data is a Symbol or ALL, or (Symbol or ALL, levels) to see only the best levels
+BOOK_LEVELS_SEPARATOR = "|"
 
 HELP = "HELP"
 MY_ORDERS = "MY ORDERS"
+METRICS = "METRICS"
+
+# several orders or order ids in one message, separated by BULK_SEPARATOR
+BULK_ADD = "BULK ADD"
+BULK_REMOVE = "BULK REMOVE"
+BULK_SEPARATOR = ","
+# removes all of the sender's open orders, optionally for one symbol only
+CANCEL_ALL = "CANCEL ALL"
+
+SYMBOLS = "SYMBOLS"
+RELOAD_SYMBOLS = "RELOAD SYMBOLS"
+
+ALL_TYPES = set([ADD, REMOVE, BOOK, HELP, MY_ORDERS, METRICS, BULK_ADD, BULK_REMOVE, CANCEL_ALL, SYMBOLS, RELOAD_SYMBOLS])
+
+# sent as the first line of a connection to switch it to fixed size binary records
+BINARY_MODE = "BINARY"
+
+# msg type, symbol id, side, amount, price in ticks, order id
+BINARY_FORMAT = struct.Struct("<BHBIqI")
+BINARY_MESSAGE_SIZE = BINARY_FORMAT.size
+
+# bulk messages have no fixed size, so they are text only
+TYPE_TO_CODE = {ADD: 1, REMOVE: 2, BOOK: 3, HELP: 4, MY_ORDERS: 5, METRICS: 6, CANCEL_ALL: 7}
+CODE_TO_TYPE = {TYPE_TO_CODE[typ]: typ for typ in TYPE_TO_CODE}
+
+SIDE_TO_CODE = {BUY: 1, SELL: 2}
+CODE_TO_SIDE = {SIDE_TO_CODE[side]: side for side in SIDE_TO_CODE}
+
+# the order type shares the side byte in its high bits, so LIMIT orders encode as they always have
+ORDER_TYPE_TO_CODE = {LIMIT: 0, MARKET: 1, IOC: 2, FOK: 3, POST: 4}
+CODE_TO_ORDER_TYPE = {ORDER_TYPE_TO_CODE[typ]: typ for typ in ORDER_TYPE_TO_CODE}
+
+def encode_side(side, order_type=LIMIT):
+    return SIDE_TO_CODE[side] | ORDER_TYPE_TO_CODE[order_type] << 4
 
-ALL_TYPES = set([ADD, REMOVE, BOOK, HELP, MY_ORDERS])
+def decode_order(symbol, side_code, price, amount):
+    # market orders are sent with a price of 0
+    if amount == 0:
+        raise ValueError("INVALID AMOUNT")
+    side = CODE_TO_SIDE[side_code & 0x0F]
+    order_type = CODE_TO_ORDER_TYPE[side_code >> 4]
+    return Order(symbol, side, None if order_type == MARKET else price, amount, order_type)
+
+ALL_SYMBOL_ID = 0xFFFF
 
 class Message:
     def __init__(self, typ, data):
@@ -25,6 +71,15 @@ class Message:
             type_string += Order.serialize(self.data)
         elif isinstance(self.data, Symbol):
             type_string += Symbol.serialize(self.data)
+        elif isinstance(self.data, tuple):
+            target, levels = self.data
+            target = target.serialize() if isinstance(target, Symbol) else target
+            type_string += f"{target}{BOOK_LEVELS_SEPARATOR}{str(levels)}"
+        elif isinstance(self.data, list):
+            type_string += BULK_SEPARATOR.join([Order.serialize(item) if isinstance(item, Order) else str(item)
+                                                for item in self.data])
+        elif self.type == CANCEL_ALL and self.data == ALL:
+            type_string = type_string[:-1]
         elif isinstance(self.data, str):
             type_string += self.data
         else:
@@ -37,6 +92,14 @@ class Message:
             return Message(HELP, None)
         elif code == MY_ORDERS:
             return Message(MY_ORDERS, None)
+        elif code == METRICS:
+            return Message(METRICS, None)
+        elif code == CANCEL_ALL:
+            return Message(CANCEL_ALL, ALL)
+        elif code == SYMBOLS:
+            return Message(SYMBOLS, None)
+        elif code == RELOAD_SYMBOLS:
+            return Message(RELOAD_SYMBOLS, None)
         
         typ, data = code.split("-")
         if typ == ADD:
@@ -44,12 +107,63 @@ class Message:
         elif typ == REMOVE:
             data = int(data)
         elif typ == BOOK:
-            if data != "ALL":
+            levels = None
+            if BOOK_LEVELS_SEPARATOR in data:
+                data, levels = data.split(BOOK_LEVELS_SEPARATOR)
+                levels = int(levels)
+                if levels <= 0:
+                    raise ValueError("INVALID BOOK LEVELS")
+            if data != ALL:
                 data = Symbol.deserialize(data)
+            if levels != None:
+                data = (data, levels)
+        elif typ == BULK_ADD:
+            data = [Order.deserialize(item) for item in data.split(BULK_SEPARATOR)]
+        elif typ == BULK_REMOVE:
+            data = [int(item) for item in data.split(BULK_SEPARATOR)]
+        elif typ == CANCEL_ALL:
+            data = Symbol.deserialize(data)
         else:
             raise ValueError("INVALID MESSAGE TYPE")
         return Message(typ, data)
 
+    def pack(self):
+        if self.type not in TYPE_TO_CODE:
+            raise ValueError("MESSAGE TYPE NOT SUPPORTED IN BINARY")
+        symbol_id, side, amount, price, order_id = 0, 0, 0, 0, 0
+        if self.type == ADD:
+            symbol_id = self.data.symbol.id
+            side = encode_side(self.data.side, self.data.type)
+            amount = self.data.amount
+            price = self.data.price if self.data.price != None else 0
+        elif self.type == REMOVE:
+            order_id = self.data
+        elif self.type == BOOK and isinstance(self.data, tuple):
+            # the levels travel in the amount field, 0 meaning all of them
+            target, amount = self.data
+            symbol_id = ALL_SYMBOL_ID if target == ALL else target.id
+        elif self.type == BOOK or self.type == CANCEL_ALL:
+            symbol_id = ALL_SYMBOL_ID if self.data == ALL else self.data.id
+        return BINARY_FORMAT.pack(TYPE_TO_CODE[self.type], symbol_id, side, amount, price, order_id)
+
+    @classmethod
+    def unpack(cls, record):
+        code, symbol_id, side, amount, price, order_id = BINARY_FORMAT.unpack(record)
+        if code not in CODE_TO_TYPE:
+            raise ValueError("INVALID MESSAGE TYPE")
+        typ = CODE_TO_TYPE[code]
+
+        data = None
+        if typ == ADD:
+            data = decode_order(Symbol.from_id(symbol_id), side, price, amount)
+        elif typ == REMOVE:
+            data = order_id
+        elif typ == BOOK or typ == CANCEL_ALL:
+            data = ALL if symbol_id == ALL_SYMBOL_ID else Symbol.from_id(symbol_id)
+            if typ == BOOK and amount > 0:
+                data = (data, amount)
+        return Message(typ, data)
+
     def __eq__(self, other):
         return self.type == other.type and self.data == other.data
 
@@ -57,9 +171,23 @@ class Message:
         return self.serialize()
 
 if __name__ == "__main__":
-    msg_1 = Message(ADD, Order(PARKER, BUY, 5, 20))
+    msg_1 = Message(ADD, Order(PARKER, BUY, PARKER.to_ticks("5"), 20))
     msg_2 = Message(REMOVE, 12)
     msg_3 = Message(BOOK, PARKER)
     msg_4 = Message(BOOK, ALL)
-    for msg in [msg_1, msg_2, msg_3, msg_4]:
-        assert Message.deserialize(msg.serialize()) == msg
\ No newline at end of file
+    msg_5 = Message(HELP, None)
+    msg_6 = Message(MY_ORDERS, None)
+    msg_7 = Message(METRICS, None)
+    msg_8 = Message(BULK_ADD, [Order(PARKER, BUY, PARKER.to_ticks("5"), 20), Order(JAKE, SELL, JAKE.to_ticks("6.25"), 5)])
+    msg_9 = Message(BULK_REMOVE, [3, 4, 12])
+    msg_10 = Message(CANCEL_ALL, ALL)
+    msg_11 = Message(CANCEL_ALL, PARKER)
+    msg_12 = Message(ADD, Order(PARKER, SELL, None, 10, MARKET))
+    msg_13 = Message(ADD, Order(PARKER, BUY, PARKER.to_ticks("5"), 20, FOK))
+    msg_14 = Message(BOOK, (PARKER, 5))
+    msg_15 = Message(BOOK, (ALL, 1))
+    for msg in [msg_1, msg_2, msg_3, msg_4, msg_8, msg_9, msg_10, msg_11, msg_12, msg_13, msg_14, msg_15]:
+        assert Message.deserialize(msg.serialize()) == msg
+    for msg in [msg_1, msg_2, msg_3, msg_4, msg_5, msg_6, msg_7, msg_10, msg_11, msg_12, msg_13, msg_14, msg_15]:
+        assert len(msg.pack()) == BINARY_MESSAGE_SIZE
+        assert Message.unpack(msg.pack()) == msg
\ No newline at end of file
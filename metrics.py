@@ -0,0 +1,174 @@
+import threading
+
+# log-linear buckets in the style of an HDR histogram: values below 2 ** SUB_BUCKET_BITS
+# get a bucket each, above that every power of two is split into 2 ** SUB_BUCKET_BITS
+# buckets, so any recorded value is off by at most about 6%. only bucket counts are kept,
+# so the mean and max are read from the buckets too, to the same precision
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+BUCKETS = SUB_BUCKETS * 64
+
+QUEUE_WAIT = "QUEUE WAIT"
+BOOK_ADD = "BOOK ADD"
+BOOK_REMOVE = "BOOK REMOVE"
+JOURNAL_APPEND = "JOURNAL APPEND"
+STREAM_PUBLISH = "STREAM PUBLISH"
+LOG_WRITE = "LOG WRITE"
+CLIENT_SEND = "CLIENT SEND"
+
+ORDERS = "ORDERS"
+FILLS = "FILLS"
+CANCELS = "CANCELS"
+
+PERCENTILES = [0.5, 0.9, 0.99, 0.999]
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+def bucket_value(index):
+    # the lowest value that lands in bucket index
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (SUB_BUCKETS + index % SUB_BUCKETS) << shift
+
+class Histogram:
+    # each histogram is meant to have a single writing thread; the few recorded from
+    # several threads may lose the odd count to a race, which is fine for monitoring
+    __slots__ = ("counts",)
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+
+    def record(self, value):
+        # bucket_index inlined for SUB_BUCKET_BITS = 4, since this runs for every timed event
+        shift = value.bit_length() - 5
+        if shift > 0:
+            self.counts[(shift << 4) + (value >> shift)] += 1
+        else:
+            self.counts[value] += 1
+
+    def add(self, other):
+        for i in range(BUCKETS):
+            self.counts[i] += other.counts[i]
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, fraction):
+        target = fraction * self.count()
+        seen = 0
+        for i in range(BUCKETS):
+            seen += self.counts[i]
+            if seen >= target and seen > 0:
+                # the highest value the bucket covers, so percentiles never under-report
+                return bucket_value(i + 1) - 1
+        return 0
+
+    def mean(self):
+        # every value is taken as the middle of its bucket
+        count = self.count()
+        if count == 0:
+            return 0
+        total = 0
+        for i in range(BUCKETS):
+            if self.counts[i] > 0:
+                total += self.counts[i] * (bucket_value(i) + bucket_value(i + 1) - 1) / 2
+        return total / count
+
+    def max(self):
+        return self.percentile(1.0)
+
+class Metrics:
+    # latency histograms in nanoseconds per stage and symbol, and event counters per symbol
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, stage, symbol=None):
+        key = (stage, symbol)
+        histogram = self.histograms.get(key)
+        if histogram == None:
+            self.lock.acquire()
+            histogram = self.histograms.setdefault(key, Histogram())
+            self.lock.release()
+        return histogram
+
+    def counter(self, symbol):
+        # a dict of counts owned by the thread that handles symbol
+        counter = self.counters.get(symbol)
+        if counter == None:
+            self.lock.acquire()
+            counter = self.counters.setdefault(symbol, {ORDERS: 0, FILLS: 0, CANCELS: 0})
+            self.lock.release()
+        return counter
+
+    def parts(self):
+        # what another process needs to merge these metrics into its own
+        return self.histograms, self.counters
+
+    def merged(self, parts):
+        # a copy of these metrics with the histograms and counters of other processes added in
+        merged = Metrics()
+        for histograms, counters in [self.parts()] + parts:
+            # listed first, since other threads may be adding keys
+            for stage, symbol in list(histograms):
+                merged.histogram(stage, symbol).add(histograms[(stage, symbol)])
+            for symbol in list(counters):
+                counter = merged.counter(symbol)
+                for name in counters[symbol]:
+                    counter[name] += counters[symbol][name]
+        return merged
+
+    def report(self):
+        lines = [f"{'STAGE':<16}{'SYMBOL':<8}{'COUNT':>10}{'MEAN':>10}" +
+                 "".join([f"{'P' + str(fraction * 100).rstrip('0').rstrip('.'):>10}" for fraction in PERCENTILES]) +
+                 f"{'MAX':>10}  (us)"]
+        for stage, symbol in sorted(self.histograms, key=lambda key: (key[0], key[1].ticker if key[1] != None else "")):
+            histogram = self.histograms[(stage, symbol)]
+            count = histogram.count()
+            if count == 0:
+                continue
+            ticker = symbol.ticker if symbol != None else "ALL"
+            line = f"{stage:<16}{ticker:<8}{count:>10}{histogram.mean() / 1000:>10.1f}"
+            for fraction in PERCENTILES:
+                line += f"{histogram.percentile(fraction) / 1000:>10.1f}"
+            line += f"{histogram.max() / 1000:>10.1f}"
+            lines.append(line)
+
+        lines.append("")
+        lines.append(f"{'SYMBOL':<8}{ORDERS:>10}{FILLS:>10}{CANCELS:>10}")
+        for symbol in sorted(self.counters):
+            counter = self.counters[symbol]
+            lines.append(f"{symbol.ticker:<8}{counter[ORDERS]:>10}{counter[FILLS]:>10}{counter[CANCELS]:>10}")
+        return "\n".join(lines)
+
+if __name__ == "__main__":
+    for value in [0, 1, 15, 16, 31, 32, 33, 1000, 123456789, 2 ** 62]:
+        index = bucket_index(value)
+        assert bucket_value(index) <= value < bucket_value(index + 1)
+
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.record(value)
+        assert histogram.counts[bucket_index(value)] > 0
+    assert histogram.count() == 1000
+    assert abs(histogram.percentile(0.5) - 500) <= 500 / SUB_BUCKETS
+    assert 1000 <= histogram.percentile(1.0) < 1000 + 1000 / SUB_BUCKETS
+    assert abs(histogram.mean() - 500.5) <= 500.5 / SUB_BUCKETS
+
+    metrics = Metrics()
+    metrics.histogram(BOOK_ADD).record(10)
+    metrics.counter("PAH")[ORDERS] += 1
+    other = Metrics()
+    other.histogram(BOOK_ADD).record(2000)
+    other.histogram(QUEUE_WAIT).record(5)
+    other.counter("PAH")[ORDERS] += 2
+    merged = metrics.merged([other.parts()])
+    assert merged.histogram(BOOK_ADD).count() == 2 and merged.histogram(BOOK_ADD).max() == 2047
+    assert merged.histogram(QUEUE_WAIT).count() == 1 and merged.counter("PAH")[ORDERS] == 3
+    assert metrics.histogram(BOOK_ADD).count() == 1
@@ -3,50 +3,110 @@ from symbol import *
 BUY = "BUY"
 SELL = "SELL"
 
+# LIMIT orders rest whatever does not fill. MARKET (which has no price) and IOC orders
+# fill what they can immediately and drop the rest, FOK orders fill completely or not at
+# all, and POST orders only ever rest, so one that would cross is dropped instead
+LIMIT = "LIMIT"
+MARKET = "MARKET"
+IOC = "IOC"
+FOK = "FOK"
+POST = "POST"
+ORDER_TYPES = set([LIMIT, MARKET, IOC, FOK, POST])
+
+# the journal and snapshots store amounts as unsigned 32 bit ints
+MAX_AMOUNT = 2 ** 32 - 1
+
+def order_string(symbol, side, amount, price):
+    price_string = MARKET if price == None else symbol.format_price(price)
+    return f"{str(symbol)} {side} {str(amount)} @ {price_string}"
+
 class Order:
-    def __init__(self, symbol, side, price, amount):
+    __slots__ = ("symbol", "side", "price", "amount", "type")
+
+    def __init__(self, symbol, side, price, amount, typ=LIMIT):
         assert ((side == BUY) or (side == SELL))
-        
+        assert typ in ORDER_TYPES
+        assert (price == None) == (typ == MARKET)
+
         self.symbol = symbol
         self.side = side
         self.price = price
         self.amount = amount
+        self.type = typ
 
     def copy(self):
-        return Order(self.symbol, self.side, self.price, self.amount)
+        return Order(self.symbol, self.side, self.price, self.amount, self.type)
 
     def serialize(self):
-        attributes = [self.symbol.serialize(), self.side, str(self.amount), str(self.price)]
+        # the type is a fifth field, left out for LIMIT and implied by the price for MARKET
+        price = MARKET if self.type == MARKET else self.symbol.format_price(self.price)
+        attributes = [self.symbol.serialize(), self.side, str(self.amount), price]
+        if self.type != LIMIT and self.type != MARKET:
+            attributes.append(self.type)
         return "|".join(attributes)
 
     @classmethod
     def deserialize(cls, code):
-        sym, side, amount, price = code.split("|")
+        attributes = code.split("|")
+        if len(attributes) == 5:
+            sym, side, amount, price, typ = attributes
+            if typ not in ORDER_TYPES or typ == MARKET:
+                raise ValueError("INVALID ORDER TYPE")
+        else:
+            sym, side, amount, price = attributes
+            typ = LIMIT
         sym = Symbol.deserialize(sym)
-        price = float(price)
+        if price == MARKET:
+            if typ != LIMIT:
+                raise ValueError("INVALID ORDER TYPE")
+            typ = MARKET
+            price = None
+        else:
+            price = sym.to_ticks(price)
         amount = int(amount)
-        return Order(sym, side, price, amount)
+        if amount <= 0 or amount > MAX_AMOUNT:
+            raise ValueError("INVALID AMOUNT")
+        return Order(sym, side, price, amount, typ)
 
     def __eq__(self, other):
         same_symbol = self.symbol == other.symbol
         same_side = self.side == other.side
         same_price = self.price == other.price
         same_amount = self.amount == other.amount
-        return same_amount and same_side and same_price and same_amount
+        same_type = self.type == other.type
+        return same_symbol and same_side and same_price and same_amount and same_type
 
     def __str__(self):
-        return f"{str(self.symbol)} {self.side} {str(self.amount)} @ {str(self.price)}"
+        string = order_string(self.symbol, self.side, self.amount, self.price)
+        if self.type != LIMIT and self.type != MARKET:
+            string += f" {self.type}"
+        return string
 
     def __repr__(self):
         return str(self)
 
 if __name__ == "__main__":
-    bid_1 = Order(PARKER, BUY, 5, 20)
-    bid_2 = Order(PARKER, BUY, 4.95, 25)
-    bid_3 = Order(PARKER, BUY, 5.50, 25)
+    bid_1 = Order(PARKER, BUY, PARKER.to_ticks("5"), 20)
+    bid_2 = Order(PARKER, BUY, PARKER.to_ticks("4.95"), 25)
+    bid_3 = Order(PARKER, BUY, PARKER.to_ticks("5.50"), 25)
 
-    ask_1 = Order(PARKER, SELL, 5.1, 15)
-    ask_2 = Order(PARKER, SELL, 5.50, 7)
+    ask_1 = Order(PARKER, SELL, PARKER.to_ticks("5.1"), 15)
+    ask_2 = Order(PARKER, SELL, PARKER.to_ticks("5.50"), 7)
 
     for order in [bid_1, bid_2, bid_3, ask_1, ask_2]:
-        assert Order.deserialize(order.serialize()) == order
\ No newline at end of file
+        assert Order.deserialize(order.serialize()) == order
+    assert Order.deserialize("PAH|BUY|25|4.9500000") == bid_2
+
+    market = Order(PARKER, SELL, None, 10, MARKET)
+    ioc = Order(PARKER, BUY, PARKER.to_ticks("5"), 20, IOC)
+    post = Order(PARKER, SELL, PARKER.to_ticks("5.1"), 15, POST)
+    for order in [market, ioc, post]:
+        assert Order.deserialize(order.serialize()) == order
+    assert Order.deserialize("PAH|SELL|10|MARKET") == market
+    assert Order.deserialize(f"PAH|BUY|{str(MAX_AMOUNT)}|5").amount == MAX_AMOUNT
+    for code in [f"PAH|BUY|{str(MAX_AMOUNT + 1)}|5", "PAH|BUY|1|99999999999999999999999"]:
+        try:
+            Order.deserialize(code)
+            assert False
+        except ValueError:
+            pass
\ No newline at end of file
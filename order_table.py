@@ -0,0 +1,103 @@
+import threading
+
+class OrderTable:
+    # the exchange's own order ids: dense ints, each naming a slot in parallel lists of owner
+    # and symbol. a finished order's slot goes on a free list and is handed out again, so the
+    # table grows with the most orders ever live at once, not with every order ever placed.
+    # each client's msg ids map to the ids of its live orders. ids are allocated by the input
+    # side and released by the output thread once no result can still refer to them
+    def __init__(self):
+        self.clients = []
+        self.msg_ids = []
+        self.symbols = []
+        self.free = []
+        self.by_client = {}
+        self.lock = threading.Lock()
+
+    def allocate(self, client_id, msg_id, symbol):
+        self.lock.acquire()
+        if len(self.free) > 0:
+            order_id = self.free.pop()
+            self.clients[order_id] = client_id
+            self.msg_ids[order_id] = msg_id
+            self.symbols[order_id] = symbol
+        else:
+            order_id = len(self.clients)
+            self.clients.append(client_id)
+            self.msg_ids.append(msg_id)
+            self.symbols.append(symbol)
+        orders = self.by_client.get(client_id)
+        if orders == None:
+            orders = {}
+            self.by_client[client_id] = orders
+        orders[msg_id] = order_id
+        self.lock.release()
+        return order_id
+
+    def release(self, order_id):
+        self.lock.acquire()
+        orders = self.by_client.get(self.clients[order_id])
+        msg_id = self.msg_ids[order_id]
+        if orders != None and orders.get(msg_id) == order_id:
+            del orders[msg_id]
+            if len(orders) == 0:
+                del self.by_client[self.clients[order_id]]
+        # the client is kept, so the highest client id ever seen can still be found
+        self.symbols[order_id] = None
+        self.free.append(order_id)
+        self.lock.release()
+
+    def release_order(self, client_id, msg_id):
+        order_id = self.find(client_id, msg_id)
+        if order_id != None:
+            self.release(order_id)
+
+    def find(self, client_id, msg_id):
+        # the id of a client's live order, or None
+        self.lock.acquire()
+        orders = self.by_client.get(client_id)
+        order_id = orders.get(msg_id) if orders != None else None
+        self.lock.release()
+        return order_id
+
+    def symbol(self, client_id, msg_id):
+        # the symbol of a client's live order, or None
+        self.lock.acquire()
+        orders = self.by_client.get(client_id)
+        order_id = orders.get(msg_id) if orders != None else None
+        symbol = self.symbols[order_id] if order_id != None else None
+        self.lock.release()
+        return symbol
+
+    def client_symbols(self, client_id):
+        # the symbols a client has live orders in, found from its own orders alone
+        self.lock.acquire()
+        orders = self.by_client.get(client_id)
+        symbols = set([self.symbols[order_id] for order_id in orders.values()]) if orders != None else set()
+        self.lock.release()
+        return symbols
+
+    def owner(self, order_id):
+        # (client id, msg id) for a live order; the slot cannot change until the order is released
+        return self.clients[order_id], self.msg_ids[order_id]
+
+    def max_client_id(self):
+        return max(self.clients) if len(self.clients) > 0 else -1
+
+    def __len__(self):
+        return len(self.clients) - len(self.free)
+
+if __name__ == "__main__":
+    table = OrderTable()
+    first = table.allocate(0, 0, "PAH")
+    second = table.allocate(0, 1, "PAH")
+    assert table.find(0, 1) == second and table.owner(second) == (0, 1)
+    table.release(first)
+    assert table.find(0, 0) == None and len(table) == 1
+    # a freed slot is reused rather than growing the table
+    assert table.allocate(3, 0, "MAK") == first and len(table.clients) == 2
+    assert table.symbol(3, 0) == "MAK" and table.max_client_id() == 3
+    assert table.client_symbols(0) == set(["PAH"]) and table.client_symbols(5) == set()
+    table.release_order(0, 1)
+    table.release_order(3, 0)
+    assert len(table) == 0 and table.by_client == {}
@@ -0,0 +1,112 @@
+from bisect import bisect_left, insort
+
+from linked_list import *
+
+class PriceLevels:
+    # one side of a book: a sorted index of distinct prices, each holding a FIFO
+    # LinkedList of order nodes. prices are keyed so that the best level is always
+    # last in the index, which keeps best() O(1) and emptying the best level a pop().
+    # the total amount resting at each price is kept alongside, and with track_changes
+    # every price whose total moved is remembered until take_changes
+    __slots__ = ("direction", "keys", "levels", "volumes", "changed", "length")
+
+    def __init__(self, descending, track_changes=False):
+        self.direction = 1 if descending else -1
+        self.keys = []
+        self.levels = {}
+        self.volumes = {}
+        self.changed = set() if track_changes else None
+        self.length = 0
+
+    def add(self, node):
+        price = node.value.price
+        level = self.levels.get(price)
+        if level == None:
+            level = LinkedList()
+            self.levels[price] = level
+            self.volumes[price] = 0
+            insort(self.keys, price * self.direction)
+        level.append_back(node)
+        self.volumes[price] += node.value.amount
+        self.length += 1
+        if self.changed != None:
+            self.changed.add(price)
+
+    def reduce(self, node, amount):
+        # a partial fill: the order keeps its place in the queue
+        node.value.amount -= amount
+        self.volumes[node.value.price] -= amount
+        if self.changed != None:
+            self.changed.add(node.value.price)
+
+    def remove(self, node):
+        price = node.value.price
+        level = self.levels[price]
+        level.remove(node)
+        self.volumes[price] -= node.value.amount
+        self.length -= 1
+        if self.changed != None:
+            self.changed.add(price)
+
+        if len(level) == 0:
+            del self.levels[price]
+            del self.volumes[price]
+            key = price * self.direction
+            if key == self.keys[-1]:
+                self.keys.pop()
+            else:
+                del self.keys[bisect_left(self.keys, key)]
+
+    def best(self):
+        if len(self.keys) == 0:
+            return None
+        return self.levels[self.keys[-1] * self.direction].head
+
+    def best_price(self):
+        if len(self.keys) == 0:
+            return None
+        return self.keys[-1] * self.direction
+
+    def volume(self, price):
+        return self.volumes.get(price, 0)
+
+    def depth(self, levels=None):
+        # (price, total amount) for the best levels, best first
+        count = len(self.keys) if levels == None else min(levels, len(self.keys))
+        depth = []
+        for i in range(len(self.keys) - 1, len(self.keys) - 1 - count, -1):
+            price = self.keys[i] * self.direction
+            depth.append((price, self.volumes[price]))
+        return depth
+
+    def orders(self, levels=None):
+        # (amount, price) for every order in the best levels, best first and in time priority
+        count = len(self.keys) if levels == None else min(levels, len(self.keys))
+        orders = []
+        for i in range(len(self.keys) - 1, len(self.keys) - 1 - count, -1):
+            current_node = self.levels[self.keys[i] * self.direction].head
+            while current_node != None:
+                orders.append((current_node.value.amount, current_node.value.price))
+                current_node = current_node.next
+        return orders
+
+    def take_changes(self):
+        # (price, total amount now) for every price changed since the last call, best first.
+        # an amount of 0 means the level is gone, or came and went before anyone saw it
+        changed = sorted(self.changed, key=lambda price: -price * self.direction)
+        self.changed.clear()
+        return [(price, self.volumes.get(price, 0)) for price in changed]
+
+    def prices(self):
+        for i in range(len(self.keys) - 1, -1, -1):
+            yield self.keys[i] * self.direction
+
+    def __iter__(self):
+        for price in self.prices():
+            current_node = self.levels[price].head
+            while current_node != None:
+                yield current_node
+                current_node = current_node.next
+
+    def __len__(self):
+        return self.length
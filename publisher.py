@@ -0,0 +1,221 @@
+import time
+import queue
+import socket
+import threading
+import selectors
+import collections
+
+DROP = "DROP"
+DISCONNECT = "DISCONNECT"
+SLOW_CONSUMER_POLICIES = set([DROP, DISCONNECT])
+
+SEND_SIZE = 65536
+
+# what an inbox item asks for: a new subscriber, an event for everyone, or an event for one subscriber
+SUBSCRIBE = "SUBSCRIBE"
+PUBLISH = "PUBLISH"
+SEND = "SEND"
+
+class Subscriber:
+    def __init__(self, subscriber_id, sock):
+        self.id = subscriber_id
+        self.socket = sock
+        self.buffer = collections.deque()
+        self.pending = b""
+        self.dropped = 0
+
+class Publisher(threading.Thread):
+    # fans stream events out to every subscriber from one thread. each event is encoded
+    # once by the caller and the same bytes are queued for every subscriber; sockets are
+    # non-blocking, so a slow subscriber only ever fills its own bounded buffer. each
+    # drained batch of events is timed into histogram when one is given
+    def __init__(self, buffer_limit, policy, closing_message=None, histogram=None):
+        super(Publisher, self).__init__(daemon=True)
+        assert policy in SLOW_CONSUMER_POLICIES
+
+        self.buffer_limit = buffer_limit
+        self.policy = policy
+        self.closing_message = closing_message
+        self.histogram = histogram
+
+        self.inbox = queue.SimpleQueue()
+        self.subscribers = {}
+        self.by_id = {}
+        self.next_id = 0
+        self.selector = selectors.DefaultSelector()
+
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.wakeup_pending = False
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+
+        self.dropped = 0
+        self.disconnected = 0
+
+    def subscribe(self, sock):
+        # returns the id send() reaches this subscriber by; called from one thread only
+        subscriber_id = self.next_id
+        self.next_id += 1
+        self.inbox.put((SUBSCRIBE, (subscriber_id, sock)))
+        self.wake()
+        return subscriber_id
+
+    def publish(self, data):
+        self.inbox.put((PUBLISH, data))
+        self.wake()
+
+    def send(self, subscriber_id, data):
+        # queued behind everything published before it, and dropped if the subscriber is gone
+        self.inbox.put((SEND, (subscriber_id, data)))
+        self.wake()
+
+    def stop(self):
+        self.inbox.put(None)
+        self.wake()
+
+    def wake(self):
+        # one wakeup byte covers any number of queued items
+        if not self.wakeup_pending:
+            self.wakeup_pending = True
+            try:
+                self.wakeup_writer.send(b"\0")
+            except BlockingIOError:
+                pass
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.fileobj is self.wakeup_reader:
+                    try:
+                        self.wakeup_reader.recv(SEND_SIZE)
+                    except BlockingIOError:
+                        pass
+                    # cleared only once the bytes are read: a wakeup sent before this point
+                    # may have been read with them, but its item is drained below
+                    self.wakeup_pending = False
+                    start = time.perf_counter_ns()
+                    if not self.drain_inbox():
+                        self.close_subscribers()
+                        return
+                    if self.histogram != None:
+                        self.histogram.record(time.perf_counter_ns() - start)
+                elif key.data.socket in self.subscribers:
+                    # draining the inbox may have removed a subscriber selected in the same batch
+                    self.flush(key.data)
+
+    def drain_inbox(self):
+        while True:
+            try:
+                item = self.inbox.get_nowait()
+            except queue.Empty:
+                return True
+            if item == None:
+                return False
+
+            kind, payload = item
+            if kind == SUBSCRIBE:
+                subscriber_id, sock = payload
+                sock.setblocking(False)
+                subscriber = Subscriber(subscriber_id, sock)
+                self.subscribers[sock] = subscriber
+                self.by_id[subscriber_id] = subscriber
+            elif kind == PUBLISH:
+                for subscriber in list(self.subscribers.values()):
+                    self.enqueue(subscriber, payload)
+            else:
+                subscriber_id, data = payload
+                subscriber = self.by_id.get(subscriber_id)
+                if subscriber != None:
+                    self.enqueue(subscriber, data)
+
+    def enqueue(self, subscriber, data):
+        if len(subscriber.buffer) >= self.buffer_limit:
+            # the buffer may only be full because a burst arrived before we got to select
+            self.flush(subscriber)
+            if subscriber.socket not in self.subscribers:
+                return
+        if len(subscriber.buffer) >= self.buffer_limit:
+            if self.policy == DROP:
+                subscriber.dropped += 1
+                self.dropped += 1
+            else:
+                self.disconnected += 1
+                self.remove(subscriber)
+            return
+
+        if subscriber.dropped > 0:
+            subscriber.buffer.append(f"{str(subscriber.dropped)} MESSAGES DROPPED\n\n".encode("utf-8"))
+            subscriber.dropped = 0
+
+        was_idle = len(subscriber.buffer) == 0 and len(subscriber.pending) == 0
+        subscriber.buffer.append(data)
+        if was_idle:
+            self.selector.register(subscriber.socket, selectors.EVENT_WRITE, subscriber)
+
+    def flush(self, subscriber):
+        chunks = [subscriber.pending]
+        size = len(subscriber.pending)
+        while len(subscriber.buffer) > 0 and size < SEND_SIZE:
+            chunk = subscriber.buffer.popleft()
+            chunks.append(chunk)
+            size += len(chunk)
+        data = b"".join(chunks)
+
+        try:
+            sent = subscriber.socket.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.remove(subscriber)
+            return
+
+        subscriber.pending = data[sent:]
+        if len(subscriber.pending) == 0 and len(subscriber.buffer) == 0:
+            self.selector.unregister(subscriber.socket)
+
+    def remove(self, subscriber):
+        # a removed subscriber's socket is closed, so it is never unregistered or closed twice
+        if subscriber.socket not in self.subscribers:
+            return
+        del self.subscribers[subscriber.socket]
+        del self.by_id[subscriber.id]
+        try:
+            self.selector.unregister(subscriber.socket)
+        except KeyError:
+            pass
+        subscriber.socket.close()
+
+    def close_subscribers(self):
+        for subscriber in list(self.subscribers.values()):
+            if self.closing_message != None:
+                try:
+                    subscriber.socket.send(self.closing_message)
+                except OSError:
+                    pass
+            self.remove(subscriber)
+
+if __name__ == "__main__":
+    # a subscriber dropped while the inbox is drained can still be selected as writable in
+    # the same batch; the wakeup is put first so the drain happens before its key is seen
+    publisher = Publisher(1, DISCONNECT)
+    slow, slow_peer = socket.socketpair()
+    fast, fast_peer = socket.socketpair()
+    publisher.subscribe(slow)
+    publisher.subscribe(fast)
+    publisher.publish(b"first")
+    publisher.wakeup_pending = False
+    publisher.wakeup_reader.recv(SEND_SIZE)
+    publisher.drain_inbox()
+    publisher.flush(publisher.subscribers[fast])
+    assert fast_peer.recv(SEND_SIZE) == b"first"
+
+    slow_peer.close()
+    publisher.publish(b"second")
+    select = publisher.selector.select
+    publisher.selector.select = lambda: sorted(select(), key=lambda item: item[0].fileobj is not publisher.wakeup_reader)
+    publisher.start()
+    assert fast_peer.recv(SEND_SIZE) == b"second"
+    assert publisher.is_alive() and list(publisher.subscribers) == [fast]
+    publisher.stop()
+    publisher.join()
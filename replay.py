@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import argparse
+
+from book import *
+from journal import *
+from message import *
+
+class Replayer:
+    # drives Books directly from recorded commands, with no server, threads or sockets,
+    # so the same input always produces the same fills and final books
+    def __init__(self):
+        self.books = {}
+        self.order_ids = {}
+        self.fills = []
+        self.errors = 0
+
+    def book(self, symbol):
+        if symbol not in self.books:
+            self.books[symbol] = Book(symbol)
+        return self.books[symbol]
+
+    def add(self, client_id, msg_id, order):
+        unique_id = (client_id, msg_id)
+        self.order_ids[unique_id] = order.symbol
+        self.fills.extend(self.book(order.symbol).add(order, unique_id))
+
+    def remove(self, client_id, order_id):
+        unique_id = (client_id, order_id)
+        if unique_id not in self.order_ids:
+            self.errors += 1
+            return
+        try:
+            self.book(self.order_ids[unique_id]).remove(unique_id)
+        except ValueError:
+            self.errors += 1
+
+    def cancel_all(self, client_id, symbol):
+        # symbol is ALL for every book
+        for unique_id in list(self.order_ids):
+            if unique_id[0] != client_id or (symbol != ALL and self.order_ids[unique_id] != symbol):
+                continue
+            book = self.book(self.order_ids[unique_id])
+            if unique_id in book.open_orders:
+                book.remove(unique_id)
+
+    def apply(self, commands):
+        for typ, client_id, msg_id, data in commands:
+            if typ == ADD:
+                self.add(client_id, msg_id, data)
+            elif typ == REMOVE:
+                self.remove(client_id, data)
+            else:
+                self.cancel_all(client_id, data)
+
+def read_text_commands(path):
+    # one Message per line, optionally prefixed with the sending client's id as in
+    # "3 ADD-PAH|BUY|20|4.95". msg ids are numbered per client the way the server does
+    commands = []
+    next_msg_ids = {}
+    with open(path) as command_file:
+        for line in command_file:
+            line = line.strip()
+            if line == "":
+                continue
+            client_id = 0
+            prefix, _, rest = line.partition(" ")
+            if prefix.isdigit() and rest != "":
+                client_id = int(prefix)
+                line = rest
+            msg_id = next_msg_ids.get(client_id, 0)
+            try:
+                msg = Message.deserialize(line.upper())
+            except Exception:
+                continue
+            next_msg_ids[client_id] = msg_id + (len(msg.data) if msg.type == BULK_ADD else 1)
+            if msg.type == ADD or msg.type == REMOVE or msg.type == CANCEL_ALL:
+                commands.append((msg.type, client_id, msg_id, msg.data))
+            elif msg.type == BULK_ADD:
+                for i in range(len(msg.data)):
+                    commands.append((ADD, client_id, msg_id + i, msg.data[i]))
+            elif msg.type == BULK_REMOVE:
+                for order_id in msg.data:
+                    commands.append((REMOVE, client_id, msg_id, order_id))
+    return commands
+
+def read_binary_commands(path):
+    # journal records, from a single segment or a whole journal directory
+    records = read_journal(path) if os.path.isdir(path) else read_segment(path)
+    commands = []
+    for seq, code, ticker, client_id, order_id, side, price, amount in records:
+        typ = CODE_TO_TYPE[code]
+        if typ == ADD:
+            symbol = Symbol.from_ticker(ticker.rstrip(b"\0").decode("utf-8"))
+            commands.append((ADD, client_id, order_id, decode_order(symbol, side, price, amount)))
+        else:
+            commands.append((REMOVE, client_id, None, order_id))
+    return commands
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="replay recorded commands straight into Book")
+    parser.add_argument("path", help="text command file, or a journal segment or directory with --binary")
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    commands = read_binary_commands(args.path) if args.binary else read_text_commands(args.path)
+    decode_seconds = time.perf_counter() - start
+
+    replayer = Replayer()
+    start = time.perf_counter()
+    replayer.apply(commands)
+    apply_seconds = time.perf_counter() - start
+
+    if not args.quiet:
+        for fill in replayer.fills:
+            print(fill)
+        for symbol in sorted(replayer.books):
+            print(replayer.books[symbol])
+
+    rate = len(commands) / apply_seconds if apply_seconds > 0 else 0
+    print(f"commands: {str(len(commands))}, fills: {str(len(replayer.fills))}, rejected removes: {str(replayer.errors)}", file=sys.stderr)
+    print(f"decode: {decode_seconds:.3f} s, apply: {apply_seconds:.3f} s ({rate:.0f} msg/s)", file=sys.stderr)
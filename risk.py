@@ -0,0 +1,167 @@
+from decimal import Decimal
+
+from order import *
+
+ORDER_AMOUNT_OVER_LIMIT = "ORDER AMOUNT OVER LIMIT"
+ORDER_NOTIONAL_OVER_LIMIT = "ORDER NOTIONAL OVER LIMIT"
+TOO_MANY_OPEN_ORDERS = "TOO MANY OPEN ORDERS"
+OPEN_AMOUNT_OVER_LIMIT = "OPEN AMOUNT OVER LIMIT"
+POSITION_OVER_LIMIT = "POSITION OVER LIMIT"
+PRICE_OUTSIDE_BAND = "PRICE OUTSIDE BAND"
+
+class RiskLimits:
+    # pre-trade limits applied to every client in every symbol; None turns a limit off.
+    # max_notional is in price units, price_band a fraction of the reference price
+    __slots__ = ("max_amount", "max_notional", "max_open_orders", "max_open_amount", "max_position", "price_band")
+
+    def __init__(self, max_amount=None, max_notional=None, max_open_orders=None,
+                 max_open_amount=None, max_position=None, price_band=None):
+        self.max_amount = max_amount
+        self.max_notional = Decimal(str(max_notional)) if max_notional != None else None
+        self.max_open_orders = max_open_orders
+        self.max_open_amount = max_open_amount
+        self.max_position = max_position
+        self.price_band = Decimal(str(price_band)) if price_band != None else None
+
+class Exposure:
+    # one client's standing in one symbol: open orders, the amount they have resting on
+    # each side and the signed amount they have bought less sold
+    __slots__ = ("open_orders", "open_buy", "open_sell", "position")
+
+    def __init__(self):
+        self.open_orders = 0
+        self.open_buy = 0
+        self.open_sell = 0
+        self.position = 0
+
+class RiskGate:
+    # checks orders for one symbol against limits before they reach the book. exposures are
+    # kept up to date from what the engine reports after every add, fill and cancel, so a
+    # check never looks at the book or the client's orders and costs the same for any
+    # number of them. like the book, a gate has a single writer, its engine
+    def __init__(self, symbol, limits):
+        self.limits = limits
+        self.exposures = {}
+        # the last trade price, or failing that the best opposite price, anchors the band
+        self.last_price = None
+        # the notional limit converted once to ticks * amount, and the band to a float, so
+        # checks stay in int and float arithmetic
+        self.max_notional = None
+        if limits.max_notional != None:
+            self.max_notional = int(limits.max_notional / symbol.tick_size)
+        self.price_band = float(limits.price_band) if limits.price_band != None else None
+
+    def exposure(self, client_id):
+        exposure = self.exposures.get(client_id)
+        if exposure == None:
+            exposure = Exposure()
+            self.exposures[client_id] = exposure
+        return exposure
+
+    def settle(self, client_id, exposure):
+        # nothing open and a flat position is what a missing exposure means too, so it is
+        # dropped and clients that stop trading do not stay in the gate for good
+        if exposure.open_orders == 0 and exposure.open_buy == 0 and exposure.open_sell == 0 \
+                and exposure.position == 0:
+            del self.exposures[client_id]
+
+    def check(self, client_id, order, best_opposite):
+        # returns why order is refused, or None when it may go to the book
+        limits = self.limits
+        amount = order.amount
+        if limits.max_amount != None and amount > limits.max_amount:
+            return ORDER_AMOUNT_OVER_LIMIT
+
+        reference = self.last_price if self.last_price != None else best_opposite
+        price = order.price if order.price != None else reference
+        if self.max_notional != None and price != None and price * amount > self.max_notional:
+            return ORDER_NOTIONAL_OVER_LIMIT
+        if self.price_band != None and order.price != None and reference != None:
+            if abs(order.price - reference) > self.price_band * reference:
+                return PRICE_OUTSIDE_BAND
+
+        exposure = self.exposures.get(client_id)
+        if exposure == None:
+            exposure = Exposure()
+        if limits.max_open_orders != None and exposure.open_orders >= limits.max_open_orders:
+            return TOO_MANY_OPEN_ORDERS
+
+        # the worst case is that everything open on this side fills, this order included
+        if order.side == BUY:
+            open_amount = exposure.open_buy + amount
+            worst_position = exposure.position + open_amount
+        else:
+            open_amount = exposure.open_sell + amount
+            worst_position = exposure.position - open_amount
+        if limits.max_open_amount != None and open_amount > limits.max_open_amount:
+            return OPEN_AMOUNT_OVER_LIMIT
+        if limits.max_position != None and abs(worst_position) > limits.max_position:
+            return POSITION_OVER_LIMIT
+        return None
+
+    def on_add(self, client_id, order, filled_orders, resting, owners):
+        # resting is the amount of order left on the book, 0 if none of it rests. owners
+        # maps each maker's key to its (client id, msg id)
+        for fill in filled_orders:
+            maker = self.exposure(owners[fill.maker_id][0])
+            signed = fill.amount if fill.taker_side == BUY else -fill.amount
+            maker.position -= signed
+            if fill.taker_side == BUY:
+                maker.open_sell -= fill.amount
+            else:
+                maker.open_buy -= fill.amount
+            if fill.maker_remaining == 0:
+                maker.open_orders -= 1
+            self.settle(owners[fill.maker_id][0], maker)
+            self.exposure(client_id).position += signed
+        if len(filled_orders) > 0:
+            self.last_price = filled_orders[-1].price
+
+        if resting > 0:
+            self.on_rest(client_id, order.side, resting)
+        elif client_id in self.exposures:
+            self.settle(client_id, self.exposures[client_id])
+
+    def on_rest(self, client_id, side, amount):
+        exposure = self.exposure(client_id)
+        exposure.open_orders += 1
+        if side == BUY:
+            exposure.open_buy += amount
+        else:
+            exposure.open_sell += amount
+
+    def on_remove(self, client_id, order):
+        exposure = self.exposure(client_id)
+        exposure.open_orders -= 1
+        if order.side == BUY:
+            exposure.open_buy -= order.amount
+        else:
+            exposure.open_sell -= order.amount
+        self.settle(client_id, exposure)
+
+if __name__ == "__main__":
+    from symbol import PARKER
+    from fill import Fill
+    gate = RiskGate(PARKER, RiskLimits(max_amount=100, max_notional=500, max_open_orders=2,
+                                       max_position=150, price_band="0.1"))
+    assert gate.check(0, Order(PARKER, BUY, 500, 101), None) == ORDER_AMOUNT_OVER_LIMIT
+    assert gate.check(0, Order(PARKER, BUY, 600, 100), None) == ORDER_NOTIONAL_OVER_LIMIT
+    assert gate.check(0, Order(PARKER, BUY, 600, 10), 500) == PRICE_OUTSIDE_BAND
+    assert gate.check(0, Order(PARKER, BUY, 500, 10), 500) == None
+
+    gate.on_rest(0, BUY, 90)
+    gate.on_rest(0, BUY, 50)
+    assert gate.check(0, Order(PARKER, SELL, 500, 10), 500) == TOO_MANY_OPEN_ORDERS
+    gate.on_remove(0, Order(PARKER, BUY, 500, 50))
+    assert gate.check(0, Order(PARKER, BUY, 500, 70), 500) == POSITION_OVER_LIMIT
+    assert gate.check(0, Order(PARKER, SELL, 500, 100), 500) == None
+
+    # a client whose orders are all gone and whose position is flat leaves nothing behind
+    gate.on_remove(0, Order(PARKER, BUY, 500, 90))
+    assert 0 not in gate.exposures
+    gate.on_rest(1, SELL, 10)
+    gate.on_add(2, Order(PARKER, BUY, 500, 10), [Fill(PARKER, BUY, 1, 2, 500, 500, 500, 10, 0, 0)], 0, {1: (1, 0)})
+    assert list(gate.exposures) == [1, 2]
+    gate.on_rest(1, BUY, 10)
+    gate.on_add(2, Order(PARKER, SELL, 500, 10), [Fill(PARKER, SELL, 1, 3, 500, 500, 500, 10, 0, 0)], 0, {1: (1, 0)})
+    assert gate.exposures == {}
@@ -0,0 +1,138 @@
+import time
+import threading
+import multiprocessing
+
+from book import *
+from engine import *
+from symbol import *
+from metrics import *
+
+# worker processes are spawned rather than forked, since the server already runs threads
+CONTEXT = multiprocessing.get_context("spawn")
+
+class ResultBatch:
+    # stands in for the outbox inside a worker: results from one drained batch of
+    # commands are collected and sent back to the server together
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def take(self):
+        items = self.items
+        self.items = []
+        return items
+
+def run_worker(definitions, tickers, inbox, results, limits):
+    # a spawned process starts with only the default symbols, so the server's are
+    # registered again in the same order to give them the same ids
+    for actual, ticker, tick_size in definitions:
+        Symbol.register(actual, ticker, tick_size)
+
+    outbox = ResultBatch()
+    metrics = Metrics()
+    engines = {}
+    for ticker in tickers:
+        symbol = Symbol.from_ticker(ticker)
+        engines[symbol] = MatchingEngine(Book(symbol, track_depth=True), outbox, metrics=metrics, limits=limits)
+
+    while True:
+        batch = inbox.recv()
+        while inbox.poll():
+            batch.extend(inbox.recv())
+
+        for item in batch:
+            if item == None:
+                results.put(outbox.take())
+                return
+            submitted, symbol, command = item
+            if symbol == None:
+                # a METRICS request for the whole worker, answered as one part of the reply
+                _, client_id, msg_id, position, total = command
+                outbox.put((METRICS, client_id, msg_id, position, total, metrics.parts()))
+                continue
+            engine = engines[symbol]
+            # perf_counter reads a system-wide monotonic clock, so the server's stamp is comparable
+            engine.queue_wait.record(time.perf_counter_ns() - submitted)
+            engine.handle(command)
+        results.put(outbox.take())
+
+class WorkerProcess:
+    # owns the books for a share of the symbols in a separate process, so their
+    # matching does not contend for the server's GIL. commands are batched on the way
+    # in as results are on the way out: submit only appends to a list, and a sender
+    # thread pickles everything queued since its last send into one pipe message
+    def __init__(self, symbols, results, limits=None):
+        self.symbols = symbols
+        inbox, self.commands = CONTEXT.Pipe(duplex=False)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.sender = threading.Thread(target=self.send_batches, daemon=True)
+        self.process = CONTEXT.Process(target=run_worker, daemon=True,
+                                       args=(symbol_definitions(), [symbol.ticker for symbol in symbols], inbox, results, limits))
+
+    def submit(self, symbol, command):
+        self.queue((time.perf_counter_ns(), symbol, command))
+
+    def request_metrics(self, client_id, msg_id, position, total):
+        self.queue((time.perf_counter_ns(), None, (METRICS, client_id, msg_id, position, total)))
+
+    def queue(self, item):
+        self.condition.acquire()
+        self.pending.append(item)
+        if len(self.pending) == 1:
+            self.condition.notify()
+        self.condition.release()
+
+    def send_batches(self):
+        while True:
+            self.condition.acquire()
+            while len(self.pending) == 0:
+                self.condition.wait()
+            batch = self.pending
+            self.pending = []
+            self.condition.release()
+
+            self.commands.send(batch)
+            if batch[-1] == None:
+                return
+
+    def start(self):
+        self.process.start()
+        self.sender.start()
+
+    def stop(self):
+        self.queue(None)
+
+class ShardEngine:
+    # what the server submits to for one symbol when engines run in worker processes
+    def __init__(self, worker, symbol):
+        self.worker = worker
+        self.symbol = symbol
+
+    def submit(self, command):
+        self.worker.submit(self.symbol, command)
+
+class ResultPump(threading.Thread):
+    # moves result batches from every worker onto the server's outbox, so the output
+    # thread handles them exactly like results from engine threads
+    def __init__(self, results, outbox):
+        super(ResultPump, self).__init__(daemon=True)
+        self.results = results
+        self.outbox = outbox
+
+    def run(self):
+        while True:
+            for item in self.results.get():
+                self.outbox.put(item)
+
+def shard_engines(symbols, workers, outbox, limits=None):
+    # symbols are dealt round robin across the workers. returns the engine stand-ins by
+    # symbol and everything that has to be started
+    results = CONTEXT.Queue()
+    count = min(workers, len(symbols))
+    processes = [WorkerProcess(symbols[i::count], results, limits) for i in range(count)]
+    # engines keep the order symbols were given in
+    engines = {symbols[i] : ShardEngine(processes[i % count], symbols[i]) for i in range(len(symbols))}
+    return engines, processes + [ResultPump(results, outbox)]
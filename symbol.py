@@ -1,20 +1,81 @@
+import json
+import pickle
+
+from decimal import Decimal, DecimalException
+
+DEFAULT_TICK_SIZE = Decimal("0.01")
+
+# the journal stores tickers in 8 bytes, and the text protocol splits fields on these
+MAX_TICKER_BYTES = 8
+TICKER_SEPARATORS = "-|,"
+# the journal and snapshots store prices as signed 64 bit tick counts
+MIN_TICKS = -2 ** 63
+MAX_TICKS = 2 ** 63 - 1
+
 TICKER_TO_ACTUAL = {"PAH": "Parker",
                     "JJG": "Jake",
                     "BEL": "Zeke",
                     "NCW": "Nate",
                     "MAK": "Mike"}
 
+TICKER_TO_TICK_SIZE = {"PAH": DEFAULT_TICK_SIZE,
+                       "JJG": DEFAULT_TICK_SIZE,
+                       "BEL": DEFAULT_TICK_SIZE,
+                       "NCW": DEFAULT_TICK_SIZE,
+                       "MAK": DEFAULT_TICK_SIZE}
+
+# every ticker maps to one shared Symbol; ids are dense and assigned in registration order
+TICKER_TO_SYMBOL = {}
+ID_TO_SYMBOL = []
+
 class Symbol:
-    def __init__(self, actual, ticker):
+    __slots__ = ("actual", "ticker", "tick_size", "id", "hash")
+
+    def __init__(self, actual, ticker, tick_size=DEFAULT_TICK_SIZE, sid=None):
         self.actual = actual
         self.ticker = ticker
+        self.tick_size = tick_size
+        self.id = sid
+        self.hash = hash(ticker)
 
     def serialize(self):
         return self.ticker
 
+    # prices are integer multiples of tick_size everywhere past the text edges
+    def to_ticks(self, price):
+        try:
+            ticks = Decimal(price) / self.tick_size
+        except DecimalException:
+            raise ValueError("INVALID PRICE")
+        if ticks != ticks.to_integral_value():
+            raise ValueError("PRICE NOT A MULTIPLE OF TICK SIZE")
+        # checked before converting, so a huge exponent never becomes a huge int
+        if ticks < MIN_TICKS or ticks > MAX_TICKS:
+            raise ValueError("PRICE OUT OF RANGE")
+        return int(ticks)
+
+    def format_price(self, ticks):
+        return str(self.tick_size * ticks)
+
+    @classmethod
+    def register(cls, actual, ticker, tick_size=DEFAULT_TICK_SIZE):
+        if ticker in TICKER_TO_SYMBOL:
+            # resting orders are priced in ticks, so a ticker keeps its first tick size
+            if TICKER_TO_SYMBOL[ticker].tick_size != tick_size:
+                raise ValueError("TICK SIZE CANNOT CHANGE")
+            return TICKER_TO_SYMBOL[ticker]
+        sym = Symbol(actual, ticker, tick_size, len(ID_TO_SYMBOL))
+        TICKER_TO_SYMBOL[ticker] = sym
+        ID_TO_SYMBOL.append(sym)
+        return sym
+
     @classmethod
     def from_ticker(cls, ticker):
-        return Symbol(TICKER_TO_ACTUAL[ticker], ticker)
+        return TICKER_TO_SYMBOL[ticker]
+
+    @classmethod
+    def from_id(cls, sid):
+        return ID_TO_SYMBOL[sid]
 
     @classmethod
     def deserialize(cls, code):
@@ -24,6 +85,8 @@ class Symbol:
         return self.ticker < other.ticker
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Symbol):
             return False
         return self.ticker == other.ticker
@@ -35,15 +98,82 @@ class Symbol:
         return str(self)
 
     def __hash__(self):
-        return hash(str(self))
+        return self.hash
+
+    def __reduce__(self):
+        # symbols sent to another process come out as that process's shared instance
+        return (Symbol.from_ticker, (self.ticker,))
+
+def valid_ticker(ticker):
+    if len(ticker) == 0 or len(ticker.encode("utf-8")) > MAX_TICKER_BYTES:
+        return False
+    return not any([separator in ticker for separator in TICKER_SEPARATORS])
+
+def load_symbols(path):
+    # a JSON list of {"ticker": ..., "name": ..., "tick_size": ...}, tick_size being optional.
+    # the whole file is checked before any symbol is registered, so a bad file registers
+    # nothing. the symbols are returned in file order
+    with open(path) as symbol_file:
+        entries = json.load(symbol_file)
+    definitions = []
+    tick_sizes = {ticker : sym.tick_size for ticker, sym in TICKER_TO_SYMBOL.items()}
+    for entry in entries:
+        ticker = entry["ticker"].upper()
+        if not valid_ticker(ticker):
+            raise ValueError(f"INVALID TICKER: {ticker}")
+        try:
+            tick_size = Decimal(str(entry.get("tick_size", DEFAULT_TICK_SIZE)))
+        except DecimalException:
+            raise ValueError(f"INVALID TICK SIZE: {ticker}")
+        # resting orders are priced in ticks, so a ticker keeps its first tick size
+        if tick_sizes.setdefault(ticker, tick_size) != tick_size:
+            raise ValueError(f"TICK SIZE CANNOT CHANGE: {ticker}")
+        definitions.append((entry["name"], ticker, tick_size))
+    return [Symbol.register(actual, ticker, tick_size) for actual, ticker, tick_size in definitions]
+
+def symbol_definitions():
+    # everything needed to register the same symbols, with the same ids, in another process
+    return [(sym.actual, sym.ticker, sym.tick_size) for sym in ID_TO_SYMBOL]
+
+for ticker in TICKER_TO_ACTUAL:
+    Symbol.register(TICKER_TO_ACTUAL[ticker], ticker, TICKER_TO_TICK_SIZE[ticker])
 
-PARKER = Symbol("Parker", "PAH")
-JAKE   = Symbol("Jake", "JJG")
-ZEKE   = Symbol("Zeke", "BEL")
-NATE   = Symbol("Nate", "NCW")
-MIKE   = Symbol("Mike", "MAK")
+PARKER = Symbol.from_ticker("PAH")
+JAKE   = Symbol.from_ticker("JJG")
+ZEKE   = Symbol.from_ticker("BEL")
+NATE   = Symbol.from_ticker("NCW")
+MIKE   = Symbol.from_ticker("MAK")
 ALL_SYMBOLS = [PARKER, JAKE, ZEKE, NATE, MIKE]
 
 if __name__ == "__main__":
     for sym in ALL_SYMBOLS:
-        assert Symbol.deserialize(sym.serialize()) == sym
\ No newline at end of file
+        assert Symbol.deserialize(sym.serialize()) is sym
+        assert Symbol.from_id(sym.id) is sym
+        assert sym.to_ticks(sym.format_price(495)) == 495
+        assert pickle.loads(pickle.dumps(sym)) is sym
+        assert valid_ticker(sym.ticker)
+    assert not valid_ticker("")
+    assert not valid_ticker("TOOLONGXX")
+    assert not valid_ticker("A-B")
+    assert not valid_ticker("A|B")
+    assert not valid_ticker("A,B")
+    for price in ["99999999999999999999999", "-99999999999999999999999", "1E+999999999", "Infinity"]:
+        try:
+            PARKER.to_ticks(price)
+            assert False
+        except ValueError:
+            pass
+    # a file that fails partway registers none of the symbols before the bad entry
+    import os
+    import tempfile
+    for bad in [{"ticker": "A|B", "name": "Bad"}, {"ticker": "PAH", "name": "Parker", "tick_size": "0.05"}]:
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as symbol_file:
+            json.dump([{"ticker": "NEW", "name": "New"}, bad], symbol_file)
+        try:
+            load_symbols(symbol_file.name)
+            assert False
+        except ValueError:
+            pass
+        finally:
+            os.remove(symbol_file.name)
+        assert "NEW" not in TICKER_TO_SYMBOL